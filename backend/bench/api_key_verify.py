@@ -0,0 +1,55 @@
+# API key verification rate: cached prefix hits, cache misses that go to the prefix index, and the whole /heartbeat route
+# python bench/api_key_verify.py [--count 50000] [--keys 1000]
+# BENCH_DATABASE_URL selects the database (default: a temporary SQLite file, DATABASE_URL is ignored), its tables are dropped and recreated
+import argparse, contextlib, io, random, time
+from common import configure, reset_database, insert_rows, rate
+
+configure()
+
+from app import app, db, User, ApiKey, generate_api_key, check_api_key, api_key_cache, heartbeat_buffer, utcnow
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--keys', type=int, default=1000)
+    args = parser.parse_args()
+    with app.app_context():
+        reset_database(db)
+        insert_rows(db, User.__table__, [{"first_name": "First", "last_name": "Last", "email": "user@example.com"}])
+        keys, rows = [], []
+        for i in range(args.keys):
+            key, prefix, key_hash = generate_api_key()
+            keys.append((key, prefix))
+            rows.append({"user_id": 1, "name": f"key {i}", "prefix": prefix, "key_hash": key_hash, "created_at": utcnow()})
+        insert_rows(db, ApiKey.__table__, rows)
+        samples = [random.choice(keys) for _ in range(args.count)]
+
+        for key, prefix in keys: # Warm the prefix cache
+            assert check_api_key(key)
+        start = time.perf_counter()
+        for key, prefix in samples:
+            check_api_key(key)
+        rate("check_api_key, cached prefix", args.count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for key, prefix in samples:
+            api_key_cache.discard(prefix)
+            check_api_key(key)
+        rate("check_api_key, prefix index lookup", args.count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for key, prefix in samples:
+            check_api_key(key[:-1] + ('A' if key[-1] != 'A' else 'B'))
+        rate("check_api_key, wrong secret", args.count, time.perf_counter() - start)
+
+    client = app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for key, prefix in samples:
+            client.post('/heartbeat', json={"code": "code"}, headers={"Authorization": f"ApiKey {key}"})
+        elapsed = time.perf_counter() - start
+        heartbeat_buffer.stop()
+    rate("/heartbeat route, one thread", args.count, elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# 10k deadlines falling due in the same second, dispatched one per batch (the old one-job-per-email shape) and in coalesced ticks
+# python bench/burst.py [--count 10000] [--max-batch 1000] [--outbox-batch 100]
+# BENCH_DATABASE_URL selects the database (default: a temporary SQLite file, DATABASE_URL is ignored), its tables are dropped and recreated
+import argparse, contextlib, io, time
+from datetime import timedelta
+from common import configure, reset_database, insert_rows, rate
+
+configure()
+
+from sqlalchemy import update, delete
+from app import app, db, User, Emails, Outbox, fire_deadlines, claim_outbox_items, deliver_outbox_items, mailer, utcnow
+from duequeue import DueQueue, INTERVAL
+from timezones import utc_timestamp
+
+def email_rows(count, due_at):
+    for i in range(count):
+        yield {"user_id": 1, "subject": f"Subject {i}", "body": "Body", "recipients": f"to{i % 50}@example{i % 5}.com", "send_time": "", "code": "code",
+               "interval": "1m", "timezone": "UTC", "last_checkin": due_at - timedelta(minutes=1), "next_due_at": due_at}
+
+def dispatch(label, count, due_epoch, tick, max_batch):
+    with app.app_context():
+        db.session.execute(update(Emails).values(interval_sent_at=None))
+        db.session.execute(delete(Outbox))
+        db.session.commit()
+    done = [0]
+    def fire(batch): # fired is counted before the callback runs, this counts batches that have committed
+        fire_deadlines(batch)
+        done[0] += len(batch)
+    due_queue = DueQueue(fire, tick=tick, max_batch=max_batch)
+    for email_id in range(1, count + 1):
+        due_queue.schedule(email_id, INTERVAL, due_epoch)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        due_queue.start()
+        while done[0] < count:
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        due_queue.stop()
+    with app.app_context():
+        queued = db.session.query(Outbox).count()
+    rate(f"{label} ({due_queue.batches} batches)", queued, elapsed)
+
+def drain_outbox(batch_size):
+    start = time.perf_counter()
+    delivered = 0
+    with contextlib.redirect_stdout(io.StringIO()), app.app_context():
+        while True:
+            items = claim_outbox_items(batch_size)
+            if not items:
+                break
+            deliver_outbox_items(items)
+            delivered += sum(item.status == 'sent' for item in items)
+            db.session.commit()
+    rate(f"outbox drain (batches of {batch_size})", delivered, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--tick', type=float, default=1)
+    parser.add_argument('--max-batch', type=int, default=1000)
+    parser.add_argument('--outbox-batch', type=int, default=100)
+    args = parser.parse_args()
+    due_at = utcnow().replace(microsecond=0) - timedelta(seconds=1)
+    with app.app_context():
+        print(f"{args.count} emails due at {due_at} on {db.engine.dialect.name}")
+        reset_database(db)
+        insert_rows(db, User.__table__, [{"first_name": "First", "last_name": "Last", "email": "user@example.com"}])
+        insert_rows(db, Emails.__table__, email_rows(args.count, due_at))
+    dispatch("one email per batch", args.count, utc_timestamp(due_at), args.tick, 1)
+    dispatch(f"coalesced, max batch {args.max_batch}", args.count, utc_timestamp(due_at), args.tick, args.max_batch)
+    drain_outbox(args.outbox_batch)
+    mailer.shutdown()
+
+if __name__ == '__main__':
+    main()
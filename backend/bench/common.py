@@ -0,0 +1,50 @@
+import os, sys, tempfile, time, statistics
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, os.path.abspath(SRC))
+
+def configure(**settings): # Must run before importing app, which reads its settings at import time. Exported variables win, except DATABASE_URL
+    workdir = tempfile.mkdtemp(prefix='ibeas-bench-')
+    defaults = {
+        'JWT_SECRET_KEY': 'bench-secret-bench-secret-bench-secret',
+        'AUTH0_DOMAIN': 'bench.invalid',
+        'MAIL_TRANSPORT': 'memory',
+        'OUTBOX_WORKERS': '0'
+    }
+    defaults.update(settings)
+    for name, value in defaults.items():
+        os.environ.setdefault(name, str(value))
+    # Benchmarks drop and recreate the tables, so the app's own DATABASE_URL is never used, only BENCH_DATABASE_URL or a scratch file
+    os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL') or f'sqlite:///{workdir}/bench.sqlite'
+    return workdir
+
+def reset_database(db): # Fresh tables on the benchmark database chosen by configure()
+    db.drop_all()
+    db.create_all()
+
+def insert_rows(db, table, rows, chunk_size=50000): # Core executemany in chunks, rows is any iterable of dicts
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+def measure(fn, samples): # Latency of each call in seconds
+    latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        fn(sample)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def summarize(label, latencies): # Milliseconds, p99 is only meaningful with enough samples
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<40} n={len(ordered):<7} mean={statistics.mean(ordered) * 1000:9.3f}ms  p50={statistics.median(ordered) * 1000:9.3f}ms  p99={p99 * 1000:9.3f}ms")
+
+def rate(label, count, seconds):
+    print(f"{label:<40} {count} in {seconds:.2f}s = {count / seconds:,.0f}/s")
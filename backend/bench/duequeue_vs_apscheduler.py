@@ -0,0 +1,91 @@
+# Memory and throughput of the due queue against the one-APScheduler-job-per-email path it replaced
+# python bench/duequeue_vs_apscheduler.py [--count 100000]
+import argparse, gc, random, time, tracemalloc
+from datetime import datetime, timedelta
+import pytz
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.date import DateTrigger
+from common import rate
+from duequeue import DueQueue, INTERVAL
+
+def send_email(email_id):
+    pass
+
+def schedule_apscheduler(deadlines):
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True) # Jobs are stored and indexed but never run
+    for email_id, due in deadlines: # Same calls as the old schedule_email_interval
+        scheduler.add_job(send_email, DateTrigger(run_date=due), args=[email_id], id=str(email_id) + "_interval", timezone=pytz.utc)
+    return scheduler
+
+def schedule_due_queue(deadlines):
+    due_queue = DueQueue(lambda batch: None)
+    for email_id, due in deadlines:
+        due_queue.schedule(email_id, INTERVAL, due.timestamp())
+    return due_queue
+
+def bench_apscheduler(deadlines, moved):
+    print(f"APScheduler, {len(deadlines)} jobs")
+    start = time.perf_counter()
+    scheduler = schedule_apscheduler(deadlines)
+    rate("  schedule", len(deadlines), time.perf_counter() - start)
+    start = time.perf_counter()
+    for email_id, due in moved: # Old reschedule_email_interval: get, remove, add
+        if scheduler.get_job(str(email_id) + "_interval"):
+            scheduler.remove_job(str(email_id) + "_interval")
+        scheduler.add_job(send_email, DateTrigger(run_date=due), args=[email_id], id=str(email_id) + "_interval", timezone=pytz.utc)
+    rate("  reschedule", len(moved), time.perf_counter() - start)
+    start = time.perf_counter()
+    for email_id, due in deadlines:
+        scheduler.remove_job(str(email_id) + "_interval")
+    rate("  unschedule", len(deadlines), time.perf_counter() - start)
+    scheduler.shutdown(wait=False)
+
+def bench_due_queue(deadlines, moved):
+    print(f"DueQueue, {len(deadlines)} deadlines")
+    start = time.perf_counter()
+    due_queue = schedule_due_queue(deadlines)
+    rate("  schedule", len(deadlines), time.perf_counter() - start)
+    start = time.perf_counter()
+    for email_id, due in moved:
+        due_queue.schedule(email_id, INTERVAL, due.timestamp())
+    rate("  reschedule", len(moved), time.perf_counter() - start)
+    start = time.perf_counter()
+    due_queue.reschedule_many(INTERVAL, [(email_id, due.timestamp()) for email_id, due in deadlines])
+    rate("  reschedule_many", len(deadlines), time.perf_counter() - start)
+    start = time.perf_counter()
+    for email_id, due in deadlines:
+        due_queue.unschedule(email_id, INTERVAL)
+    rate("  unschedule", len(deadlines), time.perf_counter() - start)
+    start = time.perf_counter()
+    for email_id, due in deadlines:
+        due_queue.schedule(email_id, INTERVAL, due.timestamp())
+    popped = 0
+    while due_queue.pop_due(float('inf')) is not None:
+        popped += 1
+    rate("  schedule + pop_due", popped, time.perf_counter() - start)
+
+def report_memory(label, schedule, deadlines): # Separate pass, tracing allocations slows everything down
+    gc.collect()
+    tracemalloc.start()
+    held = schedule(deadlines)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {current / 2**20:.1f} MiB held, {current / len(deadlines):.0f} bytes per deadline")
+    del held
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    now = datetime.now(pytz.utc)
+    deadlines = [(email_id, now + timedelta(seconds=random.randrange(60, 30 * 86400))) for email_id in range(1, args.count + 1)]
+    moved = [(email_id, due + timedelta(hours=1)) for email_id, due in random.sample(deadlines, min(len(deadlines), 10000))]
+    bench_apscheduler(deadlines, moved)
+    bench_due_queue(deadlines, moved)
+    report_memory("APScheduler memory", schedule_apscheduler, deadlines)
+    report_memory("DueQueue memory", schedule_due_queue, deadlines)
+
+if __name__ == '__main__':
+    main()
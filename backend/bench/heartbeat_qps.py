@@ -0,0 +1,75 @@
+# Sustained /heartbeat check-in QPS through the write-coalescing buffer, against committing every check-in with checkin()
+# python bench/heartbeat_qps.py [--seconds 10] [--devices 1000] [--threads 8]
+# BENCH_DATABASE_URL selects the database (default: a temporary SQLite file, DATABASE_URL is ignored), its tables are dropped and recreated
+import argparse, contextlib, io, itertools, threading, time
+from common import configure, reset_database, insert_rows, rate
+
+configure()
+
+from app import app, db, User, Emails, ApiKey, generate_api_key, checkin, heartbeat_buffer, utcnow
+
+def seed(devices): # One user per device with one email and one API key each
+    now = utcnow()
+    keys = []
+    insert_rows(db, User.__table__, ({"first_name": "First", "last_name": "Last", "email": f"device{i}@example.com"} for i in range(devices)))
+    insert_rows(db, Emails.__table__, ({"user_id": i + 1, "subject": "Subject", "body": "Body", "recipients": "to@example.com", "send_time": "", "code": "code",
+                                        "interval": "1d", "timezone": "UTC", "last_checkin": now} for i in range(devices)))
+    api_keys = []
+    for i in range(devices):
+        key, prefix, key_hash = generate_api_key()
+        keys.append(key)
+        api_keys.append({"user_id": i + 1, "name": "bench", "prefix": prefix, "key_hash": key_hash, "created_at": now})
+    insert_rows(db, ApiKey.__table__, api_keys)
+    return keys
+
+def run_for(seconds, threads, work): # Calls work(thread_index) from every thread until the time is up, returns the call count
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+    def loop(index):
+        while time.perf_counter() < deadline:
+            work(index)
+            counts[index] += 1
+    workers = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    with app.app_context():
+        reset_database(db)
+        keys = seed(args.devices)
+    devices = itertools.cycle(range(args.devices))
+    clients = [app.test_client() for _ in range(args.threads)]
+
+    def heartbeat(index):
+        key = keys[next(devices)]
+        response = clients[index].post('/heartbeat', json={"code": "code"}, headers={"Authorization": f"ApiKey {key}"})
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    def commit_checkin(index):
+        device = next(devices)
+        with app.app_context():
+            checkin(device + 1, "code")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        count = run_for(args.seconds, args.threads, heartbeat)
+        heartbeat_buffer.stop() # The final flush counts, check-ins are only done once they reach the database
+        heartbeat_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        checkins = run_for(args.seconds, args.threads, commit_checkin)
+        checkin_elapsed = time.perf_counter() - start
+    rate(f"/heartbeat, {args.threads} threads", count, heartbeat_elapsed)
+    stats = heartbeat_buffer.stats()
+    print(f"  {stats['flushes']} flushes wrote {stats['flushed']} rows, {stats['coalesced']} check-ins coalesced, {stats['flush_errors']} flush errors")
+    rate(f"checkin() commit each, {args.threads} threads", checkins, checkin_elapsed)
+
+if __name__ == '__main__':
+    main()
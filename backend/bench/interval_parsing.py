@@ -0,0 +1,62 @@
+# Interval parsing: the old is_valid_interval + parse_interval pair against parse_duration, cached and uncached
+# python bench/interval_parsing.py [--count 200000]
+import argparse, random, re, time
+from common import rate
+from intervals import parse_duration
+
+SAMPLES = ["7d", "1M", "1d", "12h", "30m", "1y", "2w", "1y 2M 3d 4h 5m", "3d12h", "7dd", "1M1M", "abc"]
+
+def old_is_valid_interval(interval): # Copied from app.py before the intervals module
+    cleaned_interval = interval.replace(" ", "")
+    type_regex = r"(\d+[yY])|(\d+M)|(\d+[dD])|(\d+[hH])|(\d+m)"
+    matches = re.findall(type_regex, cleaned_interval)
+    if not matches:
+        return False
+    types = set()
+    for match in matches:
+        match = next(m for m in match if m)
+        type_indicator = match[-1]
+        type_ = type_indicator if type_indicator in ['M', 'm'] else type_indicator.lower()
+        if type_ in types:
+            return False
+        types.add(type_)
+    return cleaned_interval == ''.join(next(m for m in match if m) for match in matches)
+
+def old_parse_interval(duration_str): # The parsing half of the old parse_interval, without the date arithmetic both versions share
+    if not old_is_valid_interval(duration_str):
+        return None
+    parts = re.findall(r'(\d+)([YyMmDdHh])', duration_str)
+    kwargs = {'years': 0, 'months': 0, 'days': 0, 'hours': 0, 'minutes': 0}
+    for num, unit in parts:
+        num = int(num)
+        if unit.lower() == 'y':
+            kwargs['years'] = num
+        elif unit.lower() == 'm' and unit.islower():
+            kwargs['minutes'] = num
+        elif unit.lower() == 'd':
+            kwargs['days'] = num
+        elif unit.lower() == 'h':
+            kwargs['hours'] = num
+        elif unit == 'M':
+            kwargs['months'] = num
+    return kwargs
+
+def bench(label, parse, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        parse(sample)
+    rate(label, len(samples), time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+    samples = [random.choice(SAMPLES) for _ in range(args.count)]
+    bench("old is_valid_interval + parse_interval", old_parse_interval, samples)
+    bench("parse_duration, uncached", parse_duration.__wrapped__, samples)
+    parse_duration.cache_clear()
+    bench("parse_duration, memoized", parse_duration, samples)
+    print(f"  {parse_duration.cache_info()}")
+
+if __name__ == '__main__':
+    main()
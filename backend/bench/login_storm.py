@@ -0,0 +1,60 @@
+# Login storm of first-time, then returning, users: the old SELECT-then-INSERT login against upsert_user, each user logging in from several tabs at once
+# python bench/login_storm.py [--users 1000] [--tabs 2] [--concurrency 50]
+# Only the database part of /login is timed, token verification is benchmarked separately
+# BENCH_DATABASE_URL selects the database (default: a temporary SQLite file, DATABASE_URL is ignored), its tables are dropped and recreated
+import argparse, collections, random, time
+from concurrent.futures import ThreadPoolExecutor
+from common import configure, reset_database, rate
+
+configure()
+
+from app import app, db, User, upsert_user
+
+def old_login(email): # What /login did before: look the user up, insert and commit if missing
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        user = User("FirstName", "LastName", email)
+        db.session.add(user)
+        db.session.commit()
+
+def new_login(email):
+    upsert_user("FirstName", "LastName", email)
+    db.session.commit()
+
+def storm(label, login, emails, concurrency, first_time=True):
+    if first_time:
+        with app.app_context():
+            reset_database(db)
+    errors = collections.Counter()
+    def run(email):
+        with app.app_context():
+            try:
+                login(email)
+            except Exception as e:
+                db.session.rollback()
+                errors[type(e).__name__] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, emails))
+    elapsed = time.perf_counter() - start
+    with app.app_context():
+        users = db.session.query(User).count()
+    rate(label, len(emails), elapsed)
+    print(f"  {users} users created, failed logins: {dict(errors) or 'none'}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tabs', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    emails = [f"user{i}@example.com" for i in range(args.users) for _ in range(args.tabs)]
+    random.shuffle(emails)
+    with app.app_context():
+        print(f"{args.users} first-time users x {args.tabs} tabs, {args.concurrency} concurrent, on {db.engine.dialect.name}")
+    for label, login in (("old SELECT then INSERT", old_login), ("upsert_user", new_login)):
+        storm(f"{label}, first-time", login, emails, args.concurrency)
+        storm(f"{label}, returning", login, emails, args.concurrency, first_time=False) # The upsert writes even when the user exists
+
+if __name__ == '__main__':
+    main()
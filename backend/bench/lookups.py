@@ -0,0 +1,51 @@
+# Lookup latency of the per-request queries with and without the 0001 indexes
+# python bench/lookups.py [--rows 1000000] [--samples 200]
+# BENCH_DATABASE_URL selects the database (default: a temporary SQLite file, DATABASE_URL is ignored), its tables are dropped and recreated
+import argparse, random
+from common import configure, reset_database, insert_rows, measure, summarize
+
+configure()
+
+from sqlalchemy import text
+from app import app, db, User, Emails
+
+INDEXES = {'ix_user_email': ('user', 'email', True), 'ix_emails_user_id_code': ('emails', 'user_id, code', False)}
+
+def user_rows(count):
+    for i in range(count):
+        yield {"first_name": "First", "last_name": "Last", "email": f"user{i}@example.com"}
+
+def email_rows(count, users):
+    for i in range(count):
+        yield {"user_id": i % users + 1, "subject": "Subject", "body": "Body", "recipients": "to@example.com", "send_time": "", "code": f"code{i % 7}", "interval": "7d", "timezone": "UTC"}
+
+def run(label, samples):
+    summarize(f"{label} User by email", measure(lambda i: User.query.filter_by(email=f"user{i}@example.com").first(), samples))
+    summarize(f"{label} Emails by (user_id, code)", measure(lambda i: Emails.query.filter(Emails.user_id == i + 1, Emails.code == f"code{i % 7}").all(), samples))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+    with app.app_context():
+        print(f"Loading {args.rows} users and {args.rows} emails into {db.engine.dialect.name}")
+        reset_database(db)
+        insert_rows(db, User.__table__, user_rows(args.rows))
+        insert_rows(db, Emails.__table__, email_rows(args.rows, args.rows))
+        samples = [random.randrange(args.rows) for _ in range(args.samples)]
+
+        for name, (table, columns, unique) in INDEXES.items():
+            db.session.execute(text(f'DROP INDEX {name}'))
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+        run("before", samples)
+
+        for name, (table, columns, unique) in INDEXES.items():
+            db.session.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX {name} ON "{table}" ({columns})'))
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+        run("after", samples)
+
+if __name__ == '__main__':
+    main()
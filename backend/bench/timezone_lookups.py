@@ -0,0 +1,39 @@
+# Timezone hot paths: validation and localization before the registry, and through it with each TIMEZONE_BACKEND
+# python bench/timezone_lookups.py [--count 100000]
+import argparse, importlib, os, random, time
+from datetime import datetime
+import pytz
+from common import rate
+import timezones
+
+def bench(label, fn, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        fn(sample)
+    rate(label, len(samples), time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    names = sorted(pytz.all_timezones)
+    samples = [random.choice(names) for _ in range(args.count)]
+    local = datetime(2026, 3, 29, 1, 30)
+
+    print("before (app.py calls into pytz)")
+    bench("  validate: name in pytz.all_timezones", lambda name: name in pytz.all_timezones, samples)
+    bench("  localize: pytz.timezone().localize()", lambda name: pytz.timezone(name).localize(local).astimezone(pytz.utc), samples)
+    bench("  from UTC: astimezone(pytz.timezone())", lambda name: pytz.utc.localize(local).astimezone(pytz.timezone(name)), samples)
+
+    for backend in ('pytz', 'zoneinfo'):
+        os.environ['TIMEZONE_BACKEND'] = backend
+        start = time.perf_counter()
+        importlib.reload(timezones)
+        print(f"timezones module, {backend} backend ({len(timezones.TIMEZONES)} zones preloaded in {time.perf_counter() - start:.2f}s)")
+        zone_samples = [name for name in samples if name in timezones.TIMEZONE_NAMES]
+        bench("  validate: is_valid_timezone", timezones.is_valid_timezone, samples)
+        bench("  localize: to_utc", lambda name: timezones.to_utc(local, name), zone_samples)
+        bench("  from UTC: from_utc", lambda name: timezones.from_utc(local, name), zone_samples)
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,40 @@
-from flask import Flask, render_template, request, redirect, abort, jsonify
-from flask_jwt_extended import JWTManager
+from flask import Flask, render_template, request, redirect, abort, jsonify, g, Response, stream_with_context
+from flask_jwt_extended import JWTManager, create_access_token, decode_token
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, update, bindparam, or_, tuple_, inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import load_only
 from dotenv import load_dotenv
+from alembic.config import Config as AlembicConfig
+from alembic.script import ScriptDirectory
+from alembic.runtime.migration import MigrationContext
 from flask_cors import CORS
 from functools import wraps
 from jose import jwt as jose_jwt
-import re, os, json
-from urllib.request import urlopen
+import re, os, time, threading, json, random, hmac, hashlib, secrets
 from authlib.integrations.flask_client import OAuth
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
-from dateutil.relativedelta import relativedelta
-import pytz
+from jwks import JWKSKeyStore
+from token_cache import VerifiedTokenCache
+from duequeue import DueQueue, SEND_TIME, INTERVAL, KIND_NAMES
+from delivery import Mailer, make_transport, is_temporary
+from heartbeat import HeartbeatBuffer
+from intervals import parse_duration
+from timezones import UTC, is_valid_timezone, to_utc, from_utc, utc_timestamp
+from email.mime.text import MIMEText
+from email.header import Header
 
 load_dotenv()
 scheduler = BackgroundScheduler()
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(seconds=int(os.getenv('SESSION_TOKEN_TTL', 900)))
 jwt = JWTManager(app)
 db = SQLAlchemy(app)
 oauth = OAuth(app)
@@ -38,8 +51,75 @@ auth0 = oauth.register(
 
 EMAIL_ROUTE = 'http://127.0.0.1:5000/email'
 
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'memory') # 'memory' or 'database'
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', 100))
+DISPATCH_POLL_INTERVAL = int(os.getenv('DISPATCH_POLL_INTERVAL', 5))
+SCHEDULER_HORIZON = int(os.getenv('SCHEDULER_HORIZON', 0)) # Seconds ahead to keep in memory, 0 keeps every future deadline
+SCHEDULER_REFILL_INTERVAL = int(os.getenv('SCHEDULER_REFILL_INTERVAL', 300))
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK', 1)) # Deadlines falling in the same tick are dispatched as one batch
+SCHEDULER_MAX_BATCH = int(os.getenv('SCHEDULER_MAX_BATCH', 1000))
+SCHEDULER_RETRY_DELAY = int(os.getenv('SCHEDULER_RETRY_DELAY', 5)) # Seconds before deadlines whose dispatch failed are fired again
+BOOTSTRAP_BATCH_SIZE = int(os.getenv('BOOTSTRAP_BATCH_SIZE', 5000))
+
+MAIL_TRANSPORT = os.getenv('MAIL_TRANSPORT', 'smtp') # 'smtp', 'maildir' or 'memory'
+MAIL_FROM = os.getenv('MAIL_FROM', 'noreply@cantsilence.me')
+MAIL_CONCURRENCY = int(os.getenv('MAIL_CONCURRENCY', 4))
+MAILDIR_PATH = os.getenv('MAILDIR_PATH', 'maildir')
+SMTP_HOST = os.getenv('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 25))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'false').lower() == 'true'
+SMTP_SSL = os.getenv('SMTP_SSL', 'false').lower() == 'true'
+SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', 30))
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', MAIL_CONCURRENCY))
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_BASE = int(os.getenv('OUTBOX_BACKOFF_BASE', 30))
+OUTBOX_BACKOFF_MAX = int(os.getenv('OUTBOX_BACKOFF_MAX', 3600))
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', 300)) # Items stuck in 'sending' this long (crashed worker) are picked up again
+OUTBOX_ERROR_MAX_LENGTH = 1000
+
 AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
 AUTH0_AUDIENCE = os.getenv('AUTH0_AUDIENCE')
+AUTH0_JWKS_URL = os.getenv('AUTH0_JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.getenv('JWKS_TTL', 3600))
+JWKS_MISS_COOLDOWN = int(os.getenv('JWKS_MISS_COOLDOWN', 30))
+
+TOKEN_CACHE_ENABLED = os.getenv('TOKEN_CACHE_ENABLED', 'true').lower() == 'true'
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_MAX_TTL = int(os.getenv('TOKEN_CACHE_MAX_TTL', 3600))
+
+# Heartbeat check-ins are acknowledged before they reach the database. On SIGTERM/SIGINT wsgi.py drains requests and
+# then flushes the buffer. A crash, SIGKILL, or a flush that fails during shutdown loses at most the last
+# HEARTBEAT_FLUSH_INTERVAL ms of check-ins, the stored deadlines then lag by that much and the next heartbeat corrects
+# them. The Flask dev server (python app.py) never flushes on exit. Use /checkin when a check-in must be durable before the response.
+HEARTBEAT_FLUSH_INTERVAL = int(os.getenv('HEARTBEAT_FLUSH_INTERVAL', 1000)) # Milliseconds
+HEARTBEAT_BUFFER_SIZE = int(os.getenv('HEARTBEAT_BUFFER_SIZE', 10000)) # Flush early once this many (user, code) pairs are waiting
+
+API_KEY_SECRET = os.getenv('API_KEY_SECRET', os.getenv('JWT_SECRET_KEY', '')) # HMAC key for stored API key hashes
+API_KEY_TAG = 'ibeas' # Keys look like ibeas_<prefix>_<secret>
+API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', 10000))
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', 60)) # Revocations reach other worker processes within this many seconds
+API_KEYS_PER_USER = int(os.getenv('API_KEYS_PER_USER', 20))
+
+EMAILS_PAGE_SIZE = int(os.getenv('EMAILS_PAGE_SIZE', 100)) # Default request_emails page, keyset on id
+EMAILS_MAX_PAGE_SIZE = int(os.getenv('EMAILS_MAX_PAGE_SIZE', 500))
+EMAILS_STREAM_BATCH_SIZE = int(os.getenv('EMAILS_STREAM_BATCH_SIZE', 500)) # Rows per server-side cursor fetch in NDJSON mode
+
+jwks_store = JWKSKeyStore(AUTH0_JWKS_URL, ttl=JWKS_TTL, miss_cooldown=JWKS_MISS_COOLDOWN)
+token_cache = VerifiedTokenCache(max_size=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL, enabled=TOKEN_CACHE_ENABLED)
+api_key_cache = VerifiedTokenCache(max_size=API_KEY_CACHE_SIZE, max_ttl=API_KEY_CACHE_TTL) # Keyed by prefix, the secret is still checked on every request
+
+if MAIL_TRANSPORT == 'smtp':
+    mail_transport = make_transport('smtp', host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                                    starttls=SMTP_STARTTLS, ssl=SMTP_SSL, timeout=SMTP_TIMEOUT, pool_size=SMTP_POOL_SIZE)
+else:
+    mail_transport = make_transport(MAIL_TRANSPORT, path=MAILDIR_PATH)
+mailer = Mailer(mail_transport, concurrency=MAIL_CONCURRENCY)
 
 USER_FIRST_NAME_MAX_LENGTH = 50
 USER_LAST_NAME_MAX_LENGTH = 50
@@ -51,12 +131,14 @@ EMAILS_SEND_TIME_MAX_LENGTH = 100
 EMAILS_CODE_MAX_LENGTH = 100
 EMAILS_INTERVAL_MAX_LENGTH = 100
 EMAILS_TIMEZONE_MAX_LENGTH = 100
+API_KEY_NAME_MAX_LENGTH = 100
+API_KEY_PREFIX_LENGTH = 12
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(USER_FIRST_NAME_MAX_LENGTH))
     last_name = db.Column(db.String(USER_LAST_NAME_MAX_LENGTH))
-    email = db.Column(db.String(USER_EMAIL_MAX_LENGTH))
+    email = db.Column(db.String(USER_EMAIL_MAX_LENGTH), unique=True, index=True)
 
     def __init__(self, first_name, last_name, email):
         self.first_name = first_name
@@ -64,16 +146,25 @@ class User(db.Model):
         self.email = email
 
 class Emails(db.Model):
+    __table_args__ = (
+        db.Index('ix_emails_user_id_code', 'user_id', 'code'),
+        db.Index('ix_emails_interval_pending', 'next_due_at', postgresql_where=db.text('interval_sent_at IS NULL'), sqlite_where=db.text('interval_sent_at IS NULL')),
+        db.Index('ix_emails_send_time_pending', 'send_at', postgresql_where=db.text('send_time_sent_at IS NULL'), sqlite_where=db.text('send_time_sent_at IS NULL'))
+    )
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     subject = db.Column(db.String(EMAILS_SUBJECT_MAX_LENGTH))
     body = db.Column(db.String(EMAILS_BODY_MAX_LENGTH))
     recipients = db.Column(db.String(EMAILS_RECIPIENTS_MAX_LENGTH))
     send_time = db.Column(db.String(EMAILS_SEND_TIME_MAX_LENGTH))
     code = db.Column(db.String(EMAILS_CODE_MAX_LENGTH))
     interval = db.Column(db.String(EMAILS_INTERVAL_MAX_LENGTH))
-    last_checkin = db.Column(db.DateTime)
+    last_checkin = db.Column(db.DateTime) # UTC
     timezone = db.Column(db.String(EMAILS_TIMEZONE_MAX_LENGTH))
+    next_due_at = db.Column(db.DateTime) # UTC deadline of the interval, see update_next_due_at
+    send_at = db.Column(db.DateTime) # UTC deadline of send_time, see update_send_at
+    interval_sent_at = db.Column(db.DateTime) # Set once the interval deadline has been dispatched
+    send_time_sent_at = db.Column(db.DateTime) # Set once the send_time deadline has been dispatched
 
     def __init__(self, user_id, subject, body, recipients, send_time, code, interval, last_checkin, timezone):
         self.user_id = user_id
@@ -85,38 +176,79 @@ class Emails(db.Model):
         self.interval = interval
         self.last_checkin = last_checkin
         self.timezone = timezone
+        self.update_next_due_at()
+        self.update_send_at()
+
+    def update_next_due_at(self): # Call whenever interval, last_checkin or timezone change
+        self.next_due_at = compute_next_due_at(self.interval, self.last_checkin, self.timezone)
+        self.interval_sent_at = None
+
+    def update_send_at(self): # Call whenever send_time or timezone change
+        self.send_at = compute_send_at(self)
+        now = utcnow()
+        self.send_time_sent_at = now if self.send_at and self.send_at <= now else None # Past send times never fire
+
+class Outbox(db.Model): # One row per fired deadline, drained by the outbox workers
+    __table_args__ = (db.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, index=True)
+    kind = db.Column(db.Integer) # SEND_TIME or INTERVAL
+    status = db.Column(db.String(20)) # pending, sending, sent or dead
+    attempts = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(OUTBOX_ERROR_MAX_LENGTH))
+    recipient_status = db.Column(db.Text) # JSON {recipient: status} of finished recipients
+
+    def __init__(self, email_id, kind, created_at):
+        self.email_id = email_id
+        self.kind = kind
+        self.status = 'pending'
+        self.attempts = 0
+        self.created_at = created_at
+        self.next_attempt_at = created_at
+
+class EmailVersion(db.Model): # Bumped by every change to a user's emails under one code, served as the listing ETag
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    code = db.Column(db.String(EMAILS_CODE_MAX_LENGTH), primary_key=True)
+    version = db.Column(db.Integer)
+
+class ApiKey(db.Model): # Machine credentials for /heartbeat, only the prefix and an HMAC of the secret are stored
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    name = db.Column(db.String(API_KEY_NAME_MAX_LENGTH))
+    prefix = db.Column(db.String(API_KEY_PREFIX_LENGTH), unique=True, index=True)
+    key_hash = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime)
+    revoked_at = db.Column(db.DateTime)
+
+    def __init__(self, user_id, name, prefix, key_hash, created_at):
+        self.user_id = user_id
+        self.name = name
+        self.prefix = prefix
+        self.key_hash = key_hash
+        self.created_at = created_at
 
 def check_auth(token): # Auth0 token verification
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
     try:
         unverified_header = jose_jwt.get_unverified_header(token)
     except jose_jwt.JWTError as e:
         print(f"Error getting unverified header: {e}")
         return False
 
-    rsa_key = {}
     if 'kid' not in unverified_header:
         print("Error: 'kid' not in unverified header")
         return False
-    
-    try:
-        jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-        jwks = json.loads(jsonurl.read())
-    except Exception as e:
-        print(f"Error retrieving JWKS: {e}")
-        return False
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-            break
-    
-    if rsa_key:
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
+
+    if rsa_key is not None:
+        g.auth_verifications = g.get('auth_verifications', 0) + 1 # Only real RS256 verifies count, cache hits do not
         try:
             payload = jose_jwt.decode(
                 token,
@@ -125,6 +257,7 @@ def check_auth(token): # Auth0 token verification
                 audience=AUTH0_AUDIENCE,
                 issuer=f'https://{AUTH0_DOMAIN}/'
             )
+            token_cache.put(token, payload)
             return payload
         except jose_jwt.ExpiredSignatureError:
             print("Error: Token is expired")
@@ -138,7 +271,75 @@ def check_auth(token): # Auth0 token verification
     
     return False
 
-def token_required(f): # API route protection
+def check_session(token): # Local HS256 session token verification
+    g.auth_verifications = g.get('auth_verifications', 0) + 1
+    try:
+        payload = decode_token(token)
+    except Exception as e:
+        print(f"Error: Session token is invalid: {e}")
+        return False
+    if payload.get('type') != 'access':
+        return False
+    return payload
+
+def is_session_token(token):
+    try:
+        return jose_jwt.get_unverified_header(token).get('alg') == 'HS256'
+    except jose_jwt.JWTError:
+        return False
+
+def hash_api_key(secret):
+    return hmac.new(API_KEY_SECRET.encode(), secret.encode(), hashlib.sha256).hexdigest()
+
+def generate_api_key(): # Returns (key, prefix, key_hash), the key itself is only ever shown once
+    prefix = secrets.token_hex(API_KEY_PREFIX_LENGTH // 2)
+    secret = secrets.token_urlsafe(32)
+    return f"{API_KEY_TAG}_{prefix}_{secret}", prefix, hash_api_key(secret)
+
+def check_api_key(key): # API key verification, an indexed lookup by prefix (cached) and a constant-time HMAC compare
+    g.auth_verifications = g.get('auth_verifications', 0) + 1
+    parts = key.split('_', 2)
+    if len(parts) != 3 or parts[0] != API_KEY_TAG or len(parts[1]) != API_KEY_PREFIX_LENGTH:
+        return False
+    prefix, secret = parts[1], parts[2]
+    entry = api_key_cache.get(prefix)
+    if entry is None:
+        row = db.session.execute(select(ApiKey.id, ApiKey.user_id, ApiKey.key_hash).where(ApiKey.prefix == prefix, ApiKey.revoked_at.is_(None))).first()
+        if row is None:
+            return False
+        entry = {"key_id": row.id, "user_id": row.user_id, "key_hash": row.key_hash}
+        api_key_cache.put(prefix, entry)
+    if not hmac.compare_digest(hash_api_key(secret), entry['key_hash']):
+        return False
+    return entry
+
+def api_key_required(f): # Machine route protection, accepts only API keys and never loads the user row
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'API key is missing!'}), 401
+
+        parts = auth_header.split()
+        if parts[0].lower() != 'apikey' or len(parts) != 2:
+            return jsonify({'error': 'API key is invalid!'}), 401
+
+        start = time.perf_counter()
+        g.auth_type = 'api_key'
+        payload = check_api_key(parts[1])
+        g.auth_time = time.perf_counter() - start
+        if not payload:
+            return jsonify({'error': 'API key is invalid!'}), 401
+
+        g.auth_payload = payload
+        return f(*args, **kwargs)
+
+    return decorated
+
+def token_required(f=None, load_user=True): # API route protection, accepts Auth0 and session tokens
+    if f is None: # Used as @token_required(load_user=False), the view looks the user up itself
+        return lambda f: token_required(f, load_user)
+
     @wraps(f)
     def decorated(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
@@ -151,23 +352,41 @@ def token_required(f): # API route protection
 
         token = parts[1]
 
-        payload = check_auth(token)
+        start = time.perf_counter()
+        g.auth_type = 'session' if is_session_token(token) else 'auth0'
+        payload = check_session(token) if g.auth_type == 'session' else check_auth(token)
+        g.auth_time = time.perf_counter() - start
         if not payload:
             print("Token is invalid!")
             return jsonify({'error': 'Token is invalid!'}), 401
 
+        g.auth_payload = payload # Verified once, views read the identity from g
+        g.auth_email = payload.get(EMAIL_ROUTE)
+        if not load_user:
+            g.user = None
+        elif g.auth_type == 'session': # The user id travels in the token
+            g.user = db.session.get(User, int(payload['sub']))
+        else:
+            g.user = User.query.filter_by(email=g.auth_email).first() if g.auth_email else None
         return f(*args, **kwargs)
 
     return decorated
 
-# def admin_protection(f): # Basic admin protection
-#     @wraps(f)
-#     def decorated(*args, **kwargs):
-#         if request.remote_addr != '127.0.0.1':
-#             abort(403)
-#         else:
-#             return f(*args, **kwargs)
-#     return decorated
+@app.after_request
+def add_auth_timing(response): # Per-request auth cost, e.g. "auth;dur=12.3;desc="1 verification"", a cached Auth0 token shows 0
+    if 'auth_time' in g:
+        verifications = g.get('auth_verifications', 0)
+        response.headers['Server-Timing'] = f'auth;dur={g.auth_time * 1000:.1f};desc="{verifications} verification{"s" if verifications != 1 else ""}"'
+    return response
+
+def admin_protection(f): # Basic admin protection
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if request.remote_addr != '127.0.0.1':
+            abort(403)
+        else:
+            return f(*args, **kwargs)
+    return decorated
 
 # @app.route('/', methods=['GET'])
 # @admin_protection
@@ -272,62 +491,84 @@ def token_required(f): # API route protection
 #     return redirect('/')
 
 @app.route('/login', methods=['POST'])
-@token_required
+@token_required(load_user=False)
 def login():
-    data = request.get_json()
-    email = data['email']
-    token = request.headers.get('Authorization').split()[1]
-    payload = check_auth(token)
-    if payload:
-        auth0_email = payload.get(EMAIL_ROUTE)
-        if auth0_email:
-            existing_user = User.query.filter_by(email=auth0_email).first()
-            if existing_user:
-                first_name = existing_user.first_name
-                last_name = existing_user.last_name
-                return {"first_name": first_name, "last_name": last_name, "email": auth0_email}
-            first_name = "FirstName"
-            last_name = "LastName"
-            if is_valid_email(auth0_email):
-                user = User(first_name, last_name, auth0_email)
-                db.session.add(user)
-                db.session.commit()
-                return {"first_name": first_name, "last_name": last_name, "email": auth0_email}
+    auth0_email = g.auth_email
+    if auth0_email and is_valid_email(auth0_email) and len(auth0_email) <= USER_EMAIL_MAX_LENGTH:
+        user = upsert_user("FirstName", "LastName", auth0_email) # Later requests carry the user id in a session token, only /session looks the email up again
+        user_info = {"first_name": user.first_name, "last_name": user.last_name, "email": auth0_email} # Read from the RETURNING row, the commit expires it
+        db.session.commit()
+        return user_info
     return {"error": "Cannot login"}
 
+@app.route('/session', methods=['POST'])
+@token_required
+def create_session():
+    if g.auth_type != 'auth0':
+        return {"error": "Session tokens must be created from an Auth0 token"}
+    user = g.user
+    if user:
+        session_token = create_access_token(identity=str(user.id), additional_claims={EMAIL_ROUTE: user.email})
+        return {"session_token": session_token, "expires_in": int(app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())}
+    return {"error": "Cannot create session"}
+
 @app.route('/get_user_names', methods=['GET'])
 @token_required
 def get_user_names():
-    token = request.headers.get('Authorization').split()[1]
-    payload = check_auth(token)
-    if payload:
-        email = payload.get(EMAIL_ROUTE)
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                return {"first_name": user.first_name, "last_name": user.last_name}
+    user = g.user
+    if user:
+        return {"first_name": user.first_name, "last_name": user.last_name}
     return {"error": "Cannot get user info"}
 
 @app.route("/request_emails", methods=['POST'])
 @token_required
 def request_emails():
-    token = request.headers.get('Authorization').split()[1]
     data = request.get_json()
-    payload = check_auth(token)
-    if payload:
-        email = payload.get(EMAIL_ROUTE)
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                if "code" in data:
-                    code = data["code"]
-                    emails = Emails.query.filter_by(user_id=user.id, code=code).all()
-                    if emails:
-                        return {"emails": [{"id": email.id, "subject": email.subject, "body": email.body, "recipients": email.recipients, "send_time": email.send_time, "interval": email.interval, "interval_next_send": parse_interval(email), "timezone": email.timezone} for email in emails]}
-                    else:
-                        return {"error": "Incorrect code or no emails found"}
+    user = g.user
+    if user:
+        if "code" in data:
+            code = data["code"]
+            fields = parse_email_fields(data.get('fields', request.args.get('fields')))
+            if fields is None:
+                return {"error": "Invalid fields"}
+            try:
+                after = int(data.get('after', request.args.get('after', 0)))
+                limit = min(int(data.get('limit', request.args.get('limit', EMAILS_PAGE_SIZE))), EMAILS_MAX_PAGE_SIZE)
+            except (TypeError, ValueError):
+                return {"error": "Invalid page"}
+            if limit < 1:
+                return {"error": "Invalid page"}
+            stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
+            etag = emails_etag(user.id, code, fields, after, limit, stream)
+            if request.if_none_match.contains_weak(etag): # Answered from the version row alone, the emails are never read
+                return Response(status=304, headers={'ETag': f'W/"{etag}"'})
+            query = Emails.query.options(load_only(*email_field_columns(fields))).filter(Emails.user_id == user.id, Emails.code == code, Emails.id > after).order_by(Emails.id)
+            if stream:
+                return Response(stream_with_context(stream_emails(query, fields)), mimetype='application/x-ndjson', headers={'ETag': f'W/"{etag}"'})
+            emails = query.limit(limit + 1).all() # One extra row tells whether there is another page
+            if emails or after:
+                next_cursor = emails[limit - 1].id if len(emails) > limit else None
+                return {"emails": [serialize_email(email, fields) for email in emails[:limit]], "next_cursor": next_cursor}, {'ETag': f'W/"{etag}"'}
+            else:
+                return {"error": "Incorrect code or no emails found"}
     return {"error": "Cannot get emails"}
 
+@app.route("/request_email_body", methods=['POST'])
+@token_required
+def request_email_body():
+    data = request.get_json()
+    user = g.user
+    if user:
+        code = data.get('code')
+        email_id = data.get('id')
+        if code and email_id:
+            body = db.session.execute(select(Emails.body).where(Emails.id == email_id, Emails.user_id == user.id, Emails.code == code)).scalar()
+            if body is not None:
+                return {"id": email_id, "body": body}
+            else:
+                return {"error": "Incorrect code or no email found"}
+    return {"error": "Cannot get email body"}
+
 @app.route('/change_name', methods=['POST'])
 @token_required
 def change_name():
@@ -336,17 +577,12 @@ def change_name():
     if len(new_name) == 2:
         first_name, last_name = new_name
         if len(first_name) <= USER_FIRST_NAME_MAX_LENGTH and len(last_name) <= USER_LAST_NAME_MAX_LENGTH:
-            token = request.headers.get('Authorization').split()[1]
-            payload = check_auth(token)
-            if payload:
-                email = payload.get(EMAIL_ROUTE)
-                if email:
-                    user = User.query.filter_by(email=email).first()
-                    if user:
-                        user.first_name = first_name
-                        user.last_name = last_name
-                        db.session.commit()
-                        return {"first_name": first_name, "last_name": last_name}
+            user = g.user
+            if user:
+                user.first_name = first_name
+                user.last_name = last_name
+                db.session.commit()
+                return {"first_name": first_name, "last_name": last_name}
         else:
             return {"error": "Name too long"}
     else:
@@ -356,134 +592,216 @@ def change_name():
 @app.route('/change_email_data', methods=['POST'])
 @token_required
 def change_email_data():
-    token = request.headers.get('Authorization').split()[1]
     data = request.get_json()
-    payload = check_auth(token)
-    if payload:
-        email = payload.get(EMAIL_ROUTE)
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                code = data.get('code')
-                changes_list = data.get('changes')
-                if code and changes_list:
-                    for changes in changes_list:
-                        for key, value in changes.items():
-                            if key == 'send_time' and value:
-                                if not is_valid_send_time(value):
-                                    return {"error": "Invalid send time in one or more emails"}
-                            elif key == 'interval':
-                                if not is_valid_interval(value):
-                                    return {"error": "Invalid interval in one or more emails"}
-                            elif key == 'recipients':
-                                if not is_valid_recipients(value):
-                                    return {"error": "Invalid recipients in one or more emails"}
-                            elif key == 'timezone':
-                                if not is_valid_timezone(value):
-                                    return {"error": "Invalid timezone in one or more emails"}
-                            if (key == 'subject' and len(value) > EMAILS_SUBJECT_MAX_LENGTH) or (key == 'body' and len(value) > EMAILS_BODY_MAX_LENGTH) or (key == 'recipients' and len(value) > EMAILS_RECIPIENTS_MAX_LENGTH) or (key == 'send_time' and len(value) > EMAILS_SEND_TIME_MAX_LENGTH) or (key == 'interval' and len(value) > EMAILS_INTERVAL_MAX_LENGTH) or (key == 'timezone' and len(value) > EMAILS_TIMEZONE_MAX_LENGTH):
-                                return {"error": "One or more values are too long"}
-                    return_info = []
-                    for changes in changes_list:
-                        email_id = changes.get('id')
-                        if email_id:
-                            email = Emails.query.filter_by(id=email_id, user_id=user.id, code=code).first()
-                            if email:
-                                old_send_time = email.send_time
-                                old_interval = email.interval
-                                for key, value in changes.items():
-                                    if key == 'subject':
-                                        email.subject = value
-                                    elif key == 'body':
-                                        email.body = value
-                                    elif key == 'recipients':
-                                        email.recipients = value
-                                    elif key == 'send_time':
-                                        email.send_time = value
-                                    elif key == 'interval':
-                                        email.interval = value
-                                        return_info.append({"id": email.id, "interval_next_send": parse_interval(email)})
-                                    elif key == 'timezone':
-                                        email.timezone = value
-                                db.session.commit()
-                                if old_send_time != email.send_time:
-                                    reschedule_email_send_time(email)
-                                if old_interval != email.interval:
-                                    reschedule_email_interval(email)
-                    return {"success": return_info}
+    user = g.user
+    if user:
+        code = data.get('code')
+        changes_list = data.get('changes')
+        if code and changes_list:
+            for changes in changes_list:
+                for key, value in changes.items():
+                    if key == 'send_time' and value:
+                        if not is_valid_send_time(value):
+                            return {"error": "Invalid send time in one or more emails"}
+                    elif key == 'interval':
+                        if not is_valid_interval(value):
+                            return {"error": "Invalid interval in one or more emails"}
+                    elif key == 'recipients':
+                        if not is_valid_recipients(value):
+                            return {"error": "Invalid recipients in one or more emails"}
+                    elif key == 'timezone':
+                        if not is_valid_timezone(value):
+                            return {"error": "Invalid timezone in one or more emails"}
+                    if (key == 'subject' and len(value) > EMAILS_SUBJECT_MAX_LENGTH) or (key == 'body' and len(value) > EMAILS_BODY_MAX_LENGTH) or (key == 'recipients' and len(value) > EMAILS_RECIPIENTS_MAX_LENGTH) or (key == 'send_time' and len(value) > EMAILS_SEND_TIME_MAX_LENGTH) or (key == 'interval' and len(value) > EMAILS_INTERVAL_MAX_LENGTH) or (key == 'timezone' and len(value) > EMAILS_TIMEZONE_MAX_LENGTH):
+                        return {"error": "One or more values are too long"}
+            email_ids = [changes['id'] for changes in changes_list if changes.get('id')]
+            emails = {str(email.id): email for email in Emails.query.filter(Emails.id.in_(email_ids), Emails.user_id == user.id, Emails.code == code)} if email_ids else {}
+            due_changed = {}
+            send_at_changed = {}
+            for changes in changes_list:
+                email = emails.get(str(changes.get('id')))
+                if email:
+                    old_send_time = email.send_time
+                    old_interval = email.interval
+                    old_timezone = email.timezone
+                    for key, value in changes.items():
+                        if key == 'subject':
+                            email.subject = value
+                        elif key == 'body':
+                            email.body = value
+                        elif key == 'recipients':
+                            email.recipients = value
+                        elif key == 'send_time':
+                            email.send_time = value
+                        elif key == 'interval':
+                            email.interval = value
+                        elif key == 'timezone':
+                            email.timezone = value
+                    if old_interval != email.interval or old_timezone != email.timezone:
+                        due_changed[email.id] = email
+                    if old_send_time != email.send_time or old_timezone != email.timezone:
+                        send_at_changed[email.id] = email
+            return_info = []
+            for email in due_changed.values():
+                email.update_next_due_at()
+                return_info.append({"id": email.id, "interval_next_send": parse_interval(email)})
+            for email in send_at_changed.values():
+                email.update_send_at()
+            # Read before the commit expires the objects, the whole save is one transaction
+            due_deadlines = [(email.id, email.next_due_at if email.interval else None) for email in due_changed.values()]
+            send_deadlines = [(email.id, email.send_at if email.send_time and not email.send_time_sent_at else None) for email in send_at_changed.values()]
+            if emails:
+                bump_email_versions([(user.id, code)])
+            db.session.commit()
+            reschedule_deadlines(SEND_TIME, send_deadlines)
+            reschedule_deadlines(INTERVAL, due_deadlines)
+            return {"success": return_info}
     return {"error": "Cannot change email data"}
 
 @app.route('/add_email_data', methods=['POST'])
 @token_required
 def add_email_data():
-    token = request.headers.get('Authorization').split()[1]
     data = request.get_json()
-    payload = check_auth(token)
-    if payload:
-        email = payload.get(EMAIL_ROUTE)
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                subject = data.get('subject')
-                body = data.get('body')
-                recipients = data.get('recipients')
-                send_time = data.get('send_time')
-                code = data.get('code')
-                interval = data.get('interval')
-                timezone = data.get('timezone')
-                last_checkin = datetime.now(pytz.timezone(timezone))
-                if send_time:
-                    if not is_valid_send_time(send_time):
-                        return {"error": "Invalid send time"}
-                if not is_valid_interval(interval):
-                    return {"error": "Invalid interval"}
-                if not is_valid_recipients(recipients):
-                    return {"error": "Invalid recipients"}
-                if not is_valid_timezone(timezone):
-                    return {"error": "Invalid timezone"}
-                if subject and body and recipients and code and interval and timezone:
-                    if len(subject) <= EMAILS_SUBJECT_MAX_LENGTH and len(body) <= EMAILS_BODY_MAX_LENGTH and len(recipients) <= EMAILS_RECIPIENTS_MAX_LENGTH and len(str(send_time)) <= EMAILS_SEND_TIME_MAX_LENGTH and len(code) <= EMAILS_CODE_MAX_LENGTH and len(interval) <= EMAILS_INTERVAL_MAX_LENGTH and len(timezone) <= EMAILS_TIMEZONE_MAX_LENGTH:
-                        email = Emails(user.id, subject, body, recipients, send_time, code, interval, last_checkin, timezone)
-                        db.session.add(email)
-                        db.session.commit()
-                        schedule_email_send_time(email)
-                        schedule_email_interval(email)
-                        return {"id": email.id, "subject": email.subject, "body": email.body, "recipients": email.recipients, "send_time": email.send_time, "interval": email.interval, "timezone": email.timezone, "interval_next_send": parse_interval(email)}
-                    else:
-                        return {"error": "One or more values are too long"}
-                else:
-                    return {"error": "Missing one or more values"}
+    user = g.user
+    if user:
+        subject = data.get('subject')
+        body = data.get('body')
+        recipients = data.get('recipients')
+        send_time = data.get('send_time')
+        code = data.get('code')
+        interval = data.get('interval')
+        timezone = data.get('timezone')
+        last_checkin = utcnow()
+        if send_time:
+            if not is_valid_send_time(send_time):
+                return {"error": "Invalid send time"}
+        if not is_valid_interval(interval):
+            return {"error": "Invalid interval"}
+        if not is_valid_recipients(recipients):
+            return {"error": "Invalid recipients"}
+        if not is_valid_timezone(timezone):
+            return {"error": "Invalid timezone"}
+        if subject and body and recipients and code and interval and timezone:
+            if len(subject) <= EMAILS_SUBJECT_MAX_LENGTH and len(body) <= EMAILS_BODY_MAX_LENGTH and len(recipients) <= EMAILS_RECIPIENTS_MAX_LENGTH and len(str(send_time)) <= EMAILS_SEND_TIME_MAX_LENGTH and len(code) <= EMAILS_CODE_MAX_LENGTH and len(interval) <= EMAILS_INTERVAL_MAX_LENGTH and len(timezone) <= EMAILS_TIMEZONE_MAX_LENGTH:
+                email = Emails(user.id, subject, body, recipients, send_time, code, interval, last_checkin, timezone)
+                db.session.add(email)
+                bump_email_versions([(user.id, code)])
+                db.session.commit()
+                schedule_email_send_time(email)
+                schedule_email_interval(email)
+                return {"id": email.id, "subject": email.subject, "body": email.body, "recipients": email.recipients, "send_time": email.send_time, "interval": email.interval, "timezone": email.timezone, "interval_next_send": parse_interval(email)}
+            else:
+                return {"error": "One or more values are too long"}
+        else:
+            return {"error": "Missing one or more values"}
     return {"error": "Cannot add email data"}
 
 @app.route('/delete_email_data', methods=['POST'])
 @token_required
 def delete_email_data():
-    token = request.headers.get('Authorization').split()[1]
     data = request.get_json()
-    payload = check_auth(token)
-    if payload:
-        email = payload.get(EMAIL_ROUTE)
-        if email:
-            user = User.query.filter_by(email=email).first()
-            if user:
-                code = data.get('code')
-                email_id = data.get('id')
-                if code and email_id:
-                    email = Emails.query.filter_by(id=email_id, user_id=user.id, code=code).first()
-                    if email:
-                        db.session.delete(email)
-                        db.session.commit()
-                        unschedule_email_send_time(email.id)
-                        unschedule_email_interval(email.id)
-                        return {"success": "Email deleted"}
+    user = g.user
+    if user:
+        code = data.get('code')
+        email_id = data.get('id')
+        if code and email_id:
+            email = Emails.query.filter_by(id=email_id, user_id=user.id, code=code).first()
+            if email:
+                db.session.delete(email)
+                bump_email_versions([(user.id, code)])
+                db.session.commit()
+                unschedule_email_send_time(email.id)
+                unschedule_email_interval(email.id)
+                return {"success": "Email deleted"}
     return {"error": "Cannot delete email data"}
 
+@app.route('/checkin', methods=['POST'])
+@token_required
+def checkin_emails():
+    data = request.get_json()
+    user = g.user
+    if user:
+        code = data.get('code')
+        if code:
+            deadlines = checkin(user.id, code)
+            if deadlines:
+                return {"amount": len(deadlines)}
+            else:
+                return {"error": "Incorrect code or no emails found"}
+    return {"error": "Cannot check in"}
+
+@app.route('/heartbeat', methods=['POST'])
+@api_key_required
+def heartbeat():
+    data = request.get_json()
+    code = data.get('code')
+    if code:
+        heartbeat_buffer.record(g.auth_payload['user_id'], code, utcnow())
+        return {"success": "Check-in recorded"}
+    return {"error": "Cannot check in"}
+
+@app.route('/create_api_key', methods=['POST'])
+@token_required
+def create_api_key():
+    data = request.get_json()
+    user = g.user
+    if user:
+        name = data.get('name')
+        if name and len(name) <= API_KEY_NAME_MAX_LENGTH:
+            active = db.session.scalar(select(db.func.count(ApiKey.id)).where(ApiKey.user_id == user.id, ApiKey.revoked_at.is_(None)))
+            if active >= API_KEYS_PER_USER:
+                return {"error": f"Cannot have more than {API_KEYS_PER_USER} API keys"}
+            key, prefix, key_hash = generate_api_key()
+            api_key = ApiKey(user.id, name, prefix, key_hash, utcnow())
+            db.session.add(api_key)
+            db.session.commit()
+            return {"id": api_key.id, "name": api_key.name, "prefix": api_key.prefix, "key": key, "created_at": api_key.created_at.isoformat()}
+    return {"error": "Cannot create API key"}
+
+@app.route('/request_api_keys', methods=['GET'])
+@token_required
+def request_api_keys():
+    user = g.user
+    if user:
+        api_keys = ApiKey.query.filter(ApiKey.user_id == user.id, ApiKey.revoked_at.is_(None)).order_by(ApiKey.id).all()
+        return {"api_keys": [{"id": api_key.id, "name": api_key.name, "prefix": api_key.prefix, "created_at": api_key.created_at.isoformat()} for api_key in api_keys]}
+    return {"error": "Cannot get API keys"}
+
+@app.route('/revoke_api_key', methods=['POST'])
+@token_required
+def revoke_api_key():
+    data = request.get_json()
+    user = g.user
+    if user:
+        api_key_id = data.get('id')
+        if api_key_id:
+            api_key = ApiKey.query.filter_by(id=api_key_id, user_id=user.id, revoked_at=None).first()
+            if api_key:
+                api_key.revoked_at = utcnow()
+                db.session.commit()
+                api_key_cache.discard(api_key.prefix)
+                return {"success": "API key revoked"}
+    return {"error": "Cannot revoke API key"}
+
 @app.route('/check_connection', methods=['GET'])
 def check_connection():
     return {"success": "Connection successful"}
 
-def is_valid_timezone(timezone):
-    return timezone in pytz.all_timezones
+@app.route('/outbox_stats', methods=['GET'])
+@admin_protection
+def get_outbox_stats():
+    return outbox_stats()
+
+@app.route('/runtime_stats', methods=['GET'])
+@admin_protection
+def get_runtime_stats(): # In-process caches and queues of this worker, each pre-forked worker keeps its own
+    return {
+        "jwks": jwks_store.stats(),
+        "token_cache": token_cache.stats(),
+        "api_key_cache": api_key_cache.stats(),
+        "due_queue": due_queue.stats(),
+        "heartbeat": heartbeat_buffer.stats()
+    }
 
 def is_valid_email(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email)
@@ -499,20 +817,10 @@ def is_valid_send_time(send_time):
         return False
 
 def is_valid_interval(interval):
-    cleaned_interval = interval.replace(" ", "")
-    type_regex = r"(\d+[yY])|(\d+M)|(\d+[dD])|(\d+[hH])|(\d+m)"
-    matches = re.findall(type_regex, cleaned_interval)
-    if not matches:
-        return False
-    types = set()
-    for match in matches:
-        match = next(m for m in match if m)
-        type_indicator = match[-1]
-        type_ = type_indicator if type_indicator in ['M', 'm'] else type_indicator.lower()
-        if type_ in types:
-            return False
-        types.add(type_)
-    return cleaned_interval == ''.join(next(m for m in match if m) for match in matches)
+    return parse_duration(interval) is not None
+
+def split_recipients(recipients):
+    return [email.strip() for email in recipients.split(',') if email.strip()]
 
 def is_valid_recipients(recipients):
     emails = [email.strip() for email in recipients.split(',')]
@@ -521,66 +829,268 @@ def is_valid_recipients(recipients):
             return False
     return True
 
-def parse_interval(email):
-    duration_str = email.interval
-    last_checkin = email.last_checkin
-    if not is_valid_interval(duration_str):
+UPSERT_DIALECTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+def upsert_user(first_name, last_name, email): # Returns the user with that email, creating it in the same round trip if needed. The caller commits
+    insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        user = User.query.filter_by(email=email).first()
+        if user is None:
+            user = User(first_name, last_name, email)
+            db.session.add(user)
+            db.session.flush()
+        return user
+    statement = insert(User).values(first_name=first_name, last_name=last_name, email=email)
+    # DO NOTHING would return no row on conflict, a no-op DO UPDATE returns the existing one
+    statement = statement.on_conflict_do_update(index_elements=[User.email], set_={"email": statement.excluded.email}).returning(User)
+    return db.session.execute(statement, execution_options={"populate_existing": True}).scalar_one()
+
+def bump_email_versions(keys): # Increments the listing version of each (user_id, code), in the caller's transaction
+    keys = sorted(set(keys)) # A fixed order so concurrent bumps cannot deadlock
+    if not keys:
+        return
+    insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        for user_id, code in keys:
+            email_version = db.session.get(EmailVersion, (user_id, code))
+            if email_version is None:
+                db.session.add(EmailVersion(user_id=user_id, code=code, version=1))
+            else:
+                email_version.version += 1
+        return
+    statement = insert(EmailVersion).values([{"user_id": user_id, "code": code, "version": 1} for user_id, code in keys])
+    db.session.execute(statement.on_conflict_do_update(index_elements=[EmailVersion.user_id, EmailVersion.code], set_={"version": EmailVersion.version + 1}))
+
+def emails_etag(user_id, code, fields, after, limit, stream): # Version plus a keyed digest of everything that shapes the response, the code never shows
+    version = db.session.execute(select(EmailVersion.version).where(EmailVersion.user_id == user_id, EmailVersion.code == code)).scalar() or 0
+    digest = hmac.new((app.config['JWT_SECRET_KEY'] or '').encode(), json.dumps([user_id, code, fields, after, limit, stream]).encode(), hashlib.sha256).hexdigest()[:16]
+    return f"{version}-{digest}"
+
+def utcnow():
+    return datetime.now(UTC).replace(tzinfo=None)
+
+def compute_next_due_at(duration_str, last_checkin, timezone): # Interval deadline as naive UTC, None if it cannot be computed
+    interval = parse_duration(duration_str) if duration_str else None
+    if not last_checkin or interval is None or not is_valid_timezone(timezone):
         return None
-    parts = re.findall(r'(\d+)([YyMmDdHh])', duration_str)
-    kwargs = {
-        'years': 0,
-        'months': 0,
-        'days': 0,
-        'hours': 0,
-        'minutes': 0
-    }
-    for num, unit in parts:
-        num = int(num)
-        if unit.lower() == 'y':
-            kwargs['years'] = num
-        elif unit.lower() == 'm' and unit.islower():
-            kwargs['minutes'] = num
-        elif unit.lower() == 'd':
-            kwargs['days'] = num
-        elif unit.lower() == 'h':
-            kwargs['hours'] = num
-        elif unit == 'M':
-            kwargs['months'] = num
-    new_datetime = last_checkin + relativedelta(
-        years=kwargs['years'],
-        months=kwargs['months'],
-        days=kwargs['days'],
-        hours=kwargs['hours'],
-        minutes=kwargs['minutes']
-    )
-    new_datetime = new_datetime.astimezone(pytz.timezone(email.timezone))
+    if last_checkin.tzinfo is not None:
+        last_checkin = last_checkin.astimezone(UTC).replace(tzinfo=None)
+    local_checkin = from_utc(last_checkin, timezone).replace(tzinfo=None) # Intervals step in the email's wall-clock time
+    return to_utc(local_checkin + interval.delta(), timezone)
+
+def compute_send_at(email): # send_time as naive UTC, None if there is none
+    if not email.send_time or not is_valid_timezone(email.timezone):
+        return None
+    try:
+        send_time = datetime.fromisoformat(email.send_time)
+    except ValueError:
+        return None
+    return to_utc(send_time, email.timezone)
+
+def parse_interval(email): # Stored interval deadline formatted in the email's timezone
+    if email.next_due_at is None:
+        return None
+    new_datetime = from_utc(email.next_due_at, email.timezone)
     formatted_datetime = new_datetime.strftime('%Y-%m-%d %H:%M:%S')
     return formatted_datetime
 
-def send_email(email_id):
+EMAIL_FIELDS = { # Listing field -> columns it reads, id is always returned
+    'subject': ('subject',),
+    'body': ('body',),
+    'recipients': ('recipients',),
+    'send_time': ('send_time',),
+    'interval': ('interval',),
+    'interval_next_send': ('next_due_at', 'timezone'),
+    'timezone': ('timezone',)
+}
+
+def parse_email_fields(fields): # "subject,recipients" or a list, every field when missing, None if any is unknown
+    if fields is None:
+        return tuple(EMAIL_FIELDS)
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if not isinstance(fields, list):
+        return None
+    fields = tuple(dict.fromkeys(field.strip() for field in fields if isinstance(field, str) and field.strip()))
+    if not all(field in EMAIL_FIELDS for field in fields):
+        return None
+    return fields
+
+def email_field_columns(fields): # Columns outside these are never read, e.g. bodies when only the list view is needed
+    return [Emails.id] + [getattr(Emails, column) for column in dict.fromkeys(column for field in fields for column in EMAIL_FIELDS[field])]
+
+def serialize_email(email, fields):
+    email_info = {"id": email.id}
+    for field in fields:
+        email_info[field] = parse_interval(email) if field == 'interval_next_send' else getattr(email, field)
+    return email_info
+
+def stream_emails(query, fields): # One JSON object per line, rows come from a server-side cursor in batches
+    for email in query.yield_per(EMAILS_STREAM_BATCH_SIZE):
+        yield json.dumps(serialize_email(email, fields)) + "\n"
+
+def build_message(email, recipients): # compat32 MIMEText, the default EmailMessage policy re-parses every header
+    message = MIMEText(email.body, 'plain', 'utf-8')
+    message['From'] = MAIL_FROM
+    message['To'] = ', '.join(recipients)
+    message['Subject'] = Header(email.subject, 'utf-8')
+    return message
+
+def enqueue_emails(email_ids, kind): # Must run in the transaction that marks the deadlines as sent
+    now = utcnow()
+    db.session.add_all([Outbox(email_id, kind, now) for email_id in email_ids])
+
+def fire_deadlines(batch): # Called by the due queue's dispatcher thread with every (email_id, kind) due in one tick
+    by_kind = {}
+    for email_id, kind in batch:
+        by_kind.setdefault(kind, []).append(email_id)
+    queued = {}
     with app.app_context():
-        email = db.session.get(Emails, email_id)
-        if email:
-            print(f"Sending email {email_id} to {email.recipients}")
+        now = utcnow()
+        for kind, email_ids in by_kind.items():
+            due_column, sent_column = deadline_columns(kind)
+            # A deadline moved by a check-in (or already claimed) after it was queued is skipped, same rule as claim_due_emails
+            queued[kind] = db.session.execute(
+                update(Emails).where(Emails.id.in_(email_ids), sent_column.is_(None), due_column <= now).values({sent_column: now}).returning(Emails.id),
+                execution_options={'synchronize_session': False}
+            ).scalars().all()
+            enqueue_emails(queued[kind], kind)
+        db.session.commit()
+    for kind, email_ids in queued.items():
+        skipped = len(by_kind[kind]) - len(email_ids)
+        print(f"[{KIND_NAMES[kind]}] Queued {len(email_ids)} email{'s' if len(email_ids) != 1 else ''}" + (f", skipped {skipped} no longer due" if skipped else ""))
+    outbox_wakeup.set()
+
+def deadline_columns(kind):
+    if kind == SEND_TIME:
+        return Emails.send_at, Emails.send_time_sent_at
+    return Emails.next_due_at, Emails.interval_sent_at
+
+def outbox_backoff(attempts): # Exponential backoff with jitter so failed items do not retry in lockstep
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+def claim_outbox_items(limit):
+    now = utcnow()
+    due = select(Outbox.id).where(Outbox.status.in_(('pending', 'sending')), Outbox.next_attempt_at <= now).order_by(Outbox.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+    claimed = db.session.execute(
+        update(Outbox).where(Outbox.id.in_(due)).values(status='sending', attempts=Outbox.attempts + 1, next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE)).returning(Outbox.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    db.session.commit()
+    return Outbox.query.filter(Outbox.id.in_(claimed)).all() if claimed else []
+
+def fail_outbox_item(item, error): # Dead after OUTBOX_MAX_ATTEMPTS, otherwise back to pending with backoff
+    item.last_error = error[:OUTBOX_ERROR_MAX_LENGTH]
+    if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+        item.status = 'dead'
+        print(f"Email {item.email_id} failed after {item.attempts} attempts: {item.last_error}")
+    else:
+        item.status = 'pending'
+        item.next_attempt_at = utcnow() + outbox_backoff(item.attempts)
+        print(f"Email {item.email_id} failed, retrying at {item.next_attempt_at}: {item.last_error}")
+
+def deliver_outbox_items(items): # Submits the whole batch to the mailer pool first, then records each result
+    emails = {email.id: email for email in Emails.query.filter(Emails.id.in_({item.email_id for item in items}))} # One IN query for the batch
+    deliveries = []
+    for item in items:
+        email = emails.get(item.email_id)
+        if not email:
+            item.status = 'dead'
+            item.last_error = "Email not found"
+            continue
+        try: # One bad item must not keep the rest of the batch from being recorded
+            statuses = json.loads(item.recipient_status) if item.recipient_status else {}
+            recipients = split_recipients(email.recipients)
+            pending = [recipient for recipient in recipients if recipient not in statuses] # Retries skip recipients that already finished
+            print(f"Sending email {email.id} to {', '.join(pending)} (attempt {item.attempts})")
+            futures = mailer.submit_by_domain(MAIL_FROM, pending, build_message(email, recipients))
+        except Exception as e:
+            fail_outbox_item(item, f"Could not submit: {e}")
+            continue
+        deliveries.append((item, email, statuses, pending, futures))
+    for item, email, statuses, pending, futures in deliveries:
+        errors = []
+        for future in futures:
+            try:
+                results = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            for recipient, status in results.items():
+                if is_temporary(status): # Left pending so the retry sends to this recipient again
+                    errors.append(f"{recipient}: {status}")
+                else:
+                    statuses[recipient] = status
+        item.recipient_status = json.dumps(statuses)
+        for recipient in pending:
+            if recipient in statuses:
+                print(f"Email {email.id} to {recipient}: {statuses[recipient]}")
+        if not errors:
+            item.status = 'sent'
+            item.sent_at = utcnow()
+            item.last_error = None
         else:
-            print(f"Email {email_id} not found")
+            fail_outbox_item(item, '; '.join(errors))
+
+outbox_wakeup = threading.Event()
+outbox_counters = {"sent": 0, "dead": 0, "retried": 0}
+
+def run_outbox_worker():
+    while True:
+        claimed = 0
+        try:
+            with app.app_context():
+                items = claim_outbox_items(OUTBOX_BATCH_SIZE)
+                claimed = len(items)
+                if items:
+                    deliver_outbox_items(items)
+                    statuses = [item.status for item in items] # Read before the commit expires every item
+                    db.session.commit()
+                    for status in statuses:
+                        outbox_counters[status if status != 'pending' else 'retried'] += 1
+        except Exception as e:
+            print(f"[OUTBOX] Error: {e}")
+        if claimed < OUTBOX_BATCH_SIZE:
+            outbox_wakeup.wait(OUTBOX_POLL_INTERVAL)
+            outbox_wakeup.clear()
+
+def start_outbox_workers():
+    for index in range(OUTBOX_WORKERS):
+        threading.Thread(target=run_outbox_worker, name=f'outbox-{index}', daemon=True).start()
+
+def outbox_stats():
+    now = utcnow()
+    counts = dict(db.session.execute(select(Outbox.status, db.func.count()).group_by(Outbox.status)).all())
+    oldest = db.session.execute(select(db.func.min(Outbox.created_at)).where(Outbox.status.in_(('pending', 'sending')))).scalar()
+    sent_last_minute = db.session.execute(select(db.func.count()).where(Outbox.status == 'sent', Outbox.sent_at >= now - timedelta(minutes=1))).scalar()
+    return {
+        "depth": counts.get('pending', 0) + counts.get('sending', 0),
+        "statuses": counts,
+        "oldest_pending_age": (now - oldest).total_seconds() if oldest else 0,
+        "sent_last_minute": sent_last_minute,
+        "worker_counters": outbox_counters
+    }
+
+due_queue = DueQueue(fire_deadlines, tick=SCHEDULER_TICK, max_batch=SCHEDULER_MAX_BATCH, retry_delay=SCHEDULER_RETRY_DELAY)
+horizon_end = None # Deadlines up to here live in the due queue, later ones are pulled in by refill_due_queue
+loaded_until = None # Deadlines up to here have been loaded from the database, trails horizon_end while a refill is failing
+
+def within_horizon(due_at):
+    return horizon_end is None or due_at <= horizon_end
 
 def schedule_email_send_time(email):
+    if SCHEDULER_MODE == 'database':
+        return
     try:
         if email.send_time:
-            send_time = datetime.fromisoformat(email.send_time)
-            pytztimezone = pytz.timezone(email.timezone)
-            send_time = pytztimezone.localize(send_time)
-            current_time = datetime.now(pytztimezone)
-            if send_time > current_time:
-                scheduler.add_job(
-                    send_email,
-                    DateTrigger(run_date=send_time),
-                    args=[email.id],
-                    id=str(email.id),
-                    timezone=pytztimezone
-                )
-                print(f"[SEND TIME] Scheduled email {email.id} for {send_time}")
+            send_time = email.send_at.replace(tzinfo=UTC)
+            if send_time > datetime.now(UTC):
+                if within_horizon(email.send_at):
+                    due_queue.schedule(email.id, SEND_TIME, send_time.timestamp())
+                    print(f"[SEND TIME] Scheduled email {email.id} for {send_time}")
+                else:
+                    print(f"[SEND TIME] Email {email.id} is beyond the scheduler horizon")
             else:
                 print(f"[SEND TIME] Email {email.id} is in the past")
         else:
@@ -589,18 +1099,17 @@ def schedule_email_send_time(email):
         print(f"[SEND TIME] Error scheduling email {email.id}: {e}")
 
 def schedule_email_interval(email):
+    if SCHEDULER_MODE == 'database':
+        return
     try:
         if email.interval:
-            interval = parse_interval(email)
-            pytztimezone = pytz.timezone(email.timezone)
-            if interval:
-                scheduler.add_job(
-                    send_email,
-                    DateTrigger(run_date=interval),
-                    args=[email.id],
-                    id=str(str(email.id) + "_interval"),
-                    timezone=pytztimezone
-                )
+            interval = email.next_due_at.replace(tzinfo=UTC) if email.next_due_at else None
+            if interval and email.interval_sent_at:
+                print(f"[INTERVAL] Email {email.id} was already sent")
+            elif interval and not within_horizon(email.next_due_at):
+                print(f"[INTERVAL] Email {email.id} is beyond the scheduler horizon")
+            elif interval:
+                due_queue.schedule(email.id, INTERVAL, interval.timestamp())
                 print(f"[INTERVAL] Scheduled email {email.id} for {interval}")
             else:
                 print(f"[INTERVAL] Email {email.id}'s interval is invalid")
@@ -610,26 +1119,20 @@ def schedule_email_interval(email):
         print(f"[INTERVAL] Error scheduling email {email.id}: {e}")
 
 def unschedule_email_send_time(email_id):
-    try:
-        job = scheduler.get_job(str(email_id))
-        if job:
-            scheduler.remove_job(str(email_id))
-            print(f"[SEND TIME] Unscheduled email {email_id}")
-        else:
-            print(f"[SEND TIME] Email {email_id} not scheduled")
-    except Exception as e:
-        print(f"[SEND TIME] Error unscheduling email {email_id}: {e}")
+    if SCHEDULER_MODE == 'database':
+        return
+    if due_queue.unschedule(email_id, SEND_TIME):
+        print(f"[SEND TIME] Unscheduled email {email_id}")
+    else:
+        print(f"[SEND TIME] Email {email_id} not scheduled")
 
 def unschedule_email_interval(email_id):
-    try:
-        job = scheduler.get_job(str(email_id) + "_interval")
-        if job:
-            scheduler.remove_job(str(email_id) + "_interval")
-            print(f"[INTERVAL] Unscheduled email {email_id} interval")
-        else:
-            print(f"[INTERVAL] Email {email_id} interval not scheduled")
-    except Exception as e:
-        print(f"[INTERVAL] Error unscheduling email {email_id}: {e}")
+    if SCHEDULER_MODE == 'database':
+        return
+    if due_queue.unschedule(email_id, INTERVAL):
+        print(f"[INTERVAL] Unscheduled email {email_id} interval")
+    else:
+        print(f"[INTERVAL] Email {email_id} interval not scheduled")
 
 def reschedule_email_interval(email):
     if email.interval:
@@ -645,22 +1148,157 @@ def reschedule_email_send_time(email):
     else:
         unschedule_email_send_time(email.id)
 
-def checkin(email):
-    email.last_checkin = datetime.now(pytz.timezone(email.timezone))
+def reschedule_deadlines(kind, deadlines): # Batch form of reschedule_email_* for [(email_id, due_at)], a due_at of None unschedules
+    if SCHEDULER_MODE == 'database':
+        return
+    # Deadlines that were beyond the horizon and still are have nothing in the queue to move, refill_due_queue picks them up
+    deadlines = [(email_id, due_at) for email_id, due_at in deadlines if (email_id, kind) in due_queue or (due_at and within_horizon(due_at))]
+    if not deadlines:
+        return
+    due_queue.reschedule_many(kind, [(email_id, utc_timestamp(due_at) if due_at and within_horizon(due_at) else None) for email_id, due_at in deadlines])
+    print(f"[{KIND_NAMES[kind]}] Rescheduled {len(deadlines)} email{'s' if len(deadlines) != 1 else ''}")
+
+def checkin(user_id, code): # Resets every email under the code in one UPDATE ... RETURNING, returns the new deadlines
+    now = utcnow()
+    rows = db.session.execute(
+        update(Emails).where(Emails.user_id == user_id, Emails.code == code).values(last_checkin=now, interval_sent_at=None).returning(Emails.id, Emails.interval, Emails.timezone),
+        execution_options={'synchronize_session': False}
+    ).all()
+    deadlines = [(email_id, compute_next_due_at(interval, now, timezone)) for email_id, interval, timezone in rows]
+    if deadlines:
+        db.session.execute(update(Emails), [{"id": email_id, "next_due_at": next_due_at} for email_id, next_due_at in deadlines])
+        bump_email_versions([(user_id, code)])
+    db.session.commit()
+    reschedule_deadlines(INTERVAL, deadlines)
+    return deadlines
+
+def flush_heartbeats(pending): # Called by the heartbeat buffer with {(user_id, code): latest check-in}
+    with app.app_context():
+        emails = Emails.__table__
+        db.session.execute( # One executemany, a check-in never moves last_checkin backwards past a newer /checkin
+            update(emails).where(
+                emails.c.user_id == bindparam('b_user_id'),
+                emails.c.code == bindparam('b_code'),
+                or_(emails.c.last_checkin.is_(None), emails.c.last_checkin < bindparam('b_last_checkin'))
+            ).values(last_checkin=bindparam('b_last_checkin'), interval_sent_at=None),
+            [{"b_user_id": user_id, "b_code": code, "b_last_checkin": checked_in_at} for (user_id, code), checked_in_at in pending.items()]
+        )
+        rows = db.session.execute(
+            select(Emails.id, Emails.interval, Emails.last_checkin, Emails.timezone, Emails.user_id, Emails.code).where(tuple_(Emails.user_id, Emails.code).in_(list(pending)))
+        ).all()
+        deadlines = [(row.id, compute_next_due_at(row.interval, row.last_checkin, row.timezone)) for row in rows]
+        if deadlines:
+            db.session.execute(update(Emails), [{"id": email_id, "next_due_at": next_due_at} for email_id, next_due_at in deadlines])
+            bump_email_versions({(row.user_id, row.code) for row in rows})
+        db.session.commit()
+    reschedule_deadlines(INTERVAL, deadlines)
+    print(f"[HEARTBEAT] Flushed {len(pending)} check-in{'s' if len(pending) != 1 else ''} covering {len(deadlines)} email{'s' if len(deadlines) != 1 else ''}")
+
+heartbeat_buffer = HeartbeatBuffer(flush_heartbeats, interval=HEARTBEAT_FLUSH_INTERVAL / 1000, max_size=HEARTBEAT_BUFFER_SIZE)
+
+def claim_due_emails(kind, limit): # Marks up to limit due emails as sent and queues them, rows locked by other nodes are skipped
+    due_column, sent_column = deadline_columns(kind)
+    now = utcnow()
+    due = select(Emails.id).where(sent_column.is_(None), due_column <= now).order_by(due_column).limit(limit).with_for_update(skip_locked=True)
+    claimed = db.session.execute(
+        update(Emails).where(Emails.id.in_(due)).values({sent_column: now}).returning(Emails.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    enqueue_emails(claimed, kind)
     db.session.commit()
-    reschedule_email_interval(email)
+    return claimed
+
+def dispatch_due_emails():
+    with app.app_context():
+        for kind in (SEND_TIME, INTERVAL):
+            while True:
+                try:
+                    claimed = claim_due_emails(kind, DISPATCH_BATCH_SIZE)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[DISPATCH] Error claiming {KIND_NAMES[kind].lower()} deadlines: {e}")
+                    break
+                if claimed:
+                    print(f"[{KIND_NAMES[kind]}] Queued emails {', '.join(map(str, claimed))}")
+                    outbox_wakeup.set()
+                if len(claimed) < DISPATCH_BATCH_SIZE:
+                    break
 
 def init_scheduler():
+    global horizon_end, loaded_until
     scheduler.start()
-    emails = Emails.query.all()
-    for email in emails:
-        if email.send_time:
-            schedule_email_send_time(email)
-        if email.interval:
-            schedule_email_interval(email)
-        
+    start_outbox_workers()
+    if SCHEDULER_MODE == 'database': # Deadlines live in the database, every node polls and claims its share
+        scheduler.add_job(dispatch_due_emails, 'interval', seconds=DISPATCH_POLL_INTERVAL, id='dispatcher', max_instances=1, coalesce=True)
+        print(f"[DISPATCH] Polling for due emails every {DISPATCH_POLL_INTERVAL}s")
+        return
+    due_queue.start()
+    now = utcnow()
+    if SCHEDULER_HORIZON: # Only deadlines inside the horizon are kept in memory
+        horizon_end = loaded_until = now + timedelta(seconds=SCHEDULER_HORIZON)
+        scheduler.add_job(refill_due_queue, 'interval', seconds=SCHEDULER_REFILL_INTERVAL, id='refill', max_instances=1, coalesce=True)
+    threading.Thread(target=bootstrap_due_queue, args=(horizon_end,), name='scheduler-bootstrap', daemon=True).start()
+
+def bootstrap_due_queue(end): # Retries until every pending deadline up to end is in memory, requests schedule their own meanwhile
+    # Overdue deadlines that never fired (downtime, a dispatch lost in a crash) are loaded too and fire at once
+    while not load_due_window(None, end, 'BOOTSTRAP'):
+        print(f"[BOOTSTRAP] Retrying in {SCHEDULER_RETRY_DELAY}s")
+        time.sleep(SCHEDULER_RETRY_DELAY)
+
+def refill_due_queue(): # Extends the in-memory window, the new horizon is published before querying so concurrent requests schedule themselves
+    global horizon_end, loaded_until
+    end = horizon_end = utcnow() + timedelta(seconds=SCHEDULER_HORIZON)
+    if load_due_window(loaded_until, end, 'REFILL'): # A failed slice is loaded again by the next refill
+        loaded_until = end
+
+def load_due_window(start, end, label): # Streams pending deadlines in (start, end] into the due queue without loading bodies or ORM objects, None leaves a side open
+    with app.app_context():
+        started = time.perf_counter()
+        scanned = 0
+        try:
+            for kind in (SEND_TIME, INTERVAL):
+                due_column, sent_column = deadline_columns(kind)
+                query = select(Emails.id, due_column).where(sent_column.is_(None), due_column.is_not(None))
+                if start:
+                    query = query.where(due_column > start)
+                if end:
+                    query = query.where(due_column <= end)
+                result = db.session.execute(query.execution_options(stream_results=True, yield_per=BOOTSTRAP_BATCH_SIZE))
+                for partition in result.partitions():
+                    for email_id, due_at in partition:
+                        if (email_id, kind) not in due_queue: # Requests served meanwhile already scheduled a newer deadline
+                            due_queue.schedule(email_id, kind, utc_timestamp(due_at))
+                    scanned += len(partition)
+                    print(f"[{label}] Loaded {scanned} deadlines in {time.perf_counter() - started:.1f}s")
+        except Exception as e: # Whatever was loaded stays scheduled, the caller retries the whole window
+            print(f"[{label}] Error after loading {scanned} deadlines: {e}")
+            return False
+        finally:
+            db.session.close()
+        print(f"[{label}] Done, {len(due_queue)} deadlines scheduled in {time.perf_counter() - started:.1f}s")
+        return True
+
+def check_schema(): # True once the database is at the latest migration, an empty database is created from the models and stamped
+    config = AlembicConfig(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+    script = ScriptDirectory.from_config(config)
+    head = script.get_current_head()
+    with db.engine.begin() as connection:
+        context = MigrationContext.configure(connection)
+        current = context.get_current_revision()
+        if current is None and not inspect(connection).get_table_names():
+            db.metadata.create_all(connection)
+            context.stamp(script, head)
+            print(f"[SCHEMA] Created a new database at revision {head}")
+            return True
+    if current != head: # Creating the missing tables here would leave a schema the migrations cannot upgrade
+        print(f"[SCHEMA] Database is at revision {current or 'none'}, run 'alembic upgrade head' to reach {head}")
+        return False
+    return True
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        if not check_schema():
+            raise SystemExit(1)
         init_scheduler()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
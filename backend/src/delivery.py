@@ -0,0 +1,144 @@
+import mailbox, os, queue, smtplib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+def is_temporary(status): # Refusals carry their SMTP reply code, 4xx (e.g. greylisting) is worth retrying, "sent" and 5xx are final
+    return status[:1] == '4'
+
+def refusal(code, message):
+    return f"{code} {message.decode(errors='replace')}"
+
+class Transport: # Delivers one message, returns {recipient: "sent" or "<SMTP code> <error>"}
+    def send(self, sender, recipients, message):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SMTPTransport(Transport): # Bounded pool of persistent SMTP connections
+    def __init__(self, host, port=25, username=None, password=None, starttls=False, ssl=False, timeout=30, pool_size=4):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.ssl = ssl
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.connections_opened = 0
+
+    def _connect(self):
+        if self.ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        self.connections_opened += 1
+        return connection
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def send(self, sender, recipients, message):
+        with self._slots: # At most pool_size connections are in use at once
+            connection = None
+            for attempt in range(2): # A pooled connection may have been dropped by the server, reconnect once
+                try:
+                    connection = self._connect() if attempt else self._acquire()
+                    refused = connection.sendmail(sender, recipients, message.as_bytes())
+                    self._idle.put(connection)
+                    return {recipient: refusal(*refused[recipient]) if recipient in refused else "sent" for recipient in recipients}
+                except smtplib.SMTPRecipientsRefused as e:
+                    self._idle.put(connection)
+                    return {recipient: refusal(*e.recipients[recipient]) if recipient in e.recipients else "sent" for recipient in recipients}
+                except smtplib.SMTPResponseException: # Sender or data rejected, the connection itself is still usable
+                    if connection is None:
+                        raise
+                    try:
+                        connection.rset()
+                        self._idle.put(connection)
+                    except (smtplib.SMTPException, OSError):
+                        self._discard(connection)
+                    raise
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    if connection is not None:
+                        self._discard(connection)
+                        connection = None
+                    if attempt:
+                        raise
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.quit()
+            except Exception:
+                self._discard(connection)
+
+class MaildirTransport(Transport): # Writes messages to a local Maildir instead of sending them
+    def __init__(self, path):
+        self.mailbox = mailbox.Maildir(os.path.expanduser(path), create=True)
+        self._lock = threading.Lock()
+
+    def send(self, sender, recipients, message):
+        with self._lock:
+            self.mailbox.add(message)
+        return {recipient: "sent" for recipient in recipients}
+
+class MemoryTransport(Transport): # Keeps messages in a list, for tests
+    def __init__(self):
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send(self, sender, recipients, message):
+        with self._lock:
+            self.outbox.append((sender, list(recipients), message))
+        return {recipient: "sent" for recipient in recipients}
+
+def group_by_domain(recipients): # Recipients sharing a destination domain go out in one SMTP transaction
+    groups = {}
+    for recipient in recipients:
+        groups.setdefault(recipient.rpartition('@')[2].lower(), []).append(recipient)
+    return groups
+
+def make_transport(name, **options):
+    if name == 'smtp':
+        return SMTPTransport(**options)
+    elif name == 'maildir':
+        return MaildirTransport(options.get('path', 'maildir'))
+    elif name == 'memory':
+        return MemoryTransport()
+    raise ValueError(f"Unknown mail transport: {name}")
+
+class Mailer: # Sends on a bounded worker pool so callers never wait on the transport
+    def __init__(self, transport, concurrency=4):
+        self.transport = transport
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='mailer')
+
+    def send(self, sender, recipients, message):
+        return self.transport.send(sender, recipients, message)
+
+    def submit(self, sender, recipients, message):
+        return self._executor.submit(self.send, sender, recipients, message)
+
+    def submit_by_domain(self, sender, recipients, message): # One transaction with several RCPT TO per domain instead of one message per recipient
+        return [self.submit(sender, group, message) for group in group_by_domain(recipients).values()]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self.transport.close()
@@ -0,0 +1,157 @@
+import heapq, math, threading, time
+
+SEND_TIME = 0
+INTERVAL = 1
+KIND_NAMES = {SEND_TIME: 'SEND TIME', INTERVAL: 'INTERVAL'}
+
+ID_BITS = 33 # email_id (32 bits) and kind (1 bit) share the low bits of a heap entry
+
+class DueQueue: # Min-heap of (due_epoch, email_id, kind) deadlines with one dispatcher thread
+    def __init__(self, callback, tick=1, max_batch=1000, retry_delay=5):
+        self._callback = callback # Called with a list of (email_id, kind) that fell due in the same tick
+        self.tick = tick
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay # Seconds before a batch whose callback raised is fired again
+        self._heap = [] # Each entry is one int: due_epoch << ID_BITS | email_id << 1 | kind
+        self._due = {} # email_id << 1 | kind -> due_epoch of the live entry, anything else in the heap is stale
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.fired = 0
+        self.batches = 0
+        self.retried = 0
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, item):
+        email_id, kind = item
+        return (email_id << 1 | kind) in self._due
+
+    def get(self, email_id, kind):
+        return self._due.get(email_id << 1 | kind)
+
+    def schedule(self, email_id, kind, due_epoch): # Also reschedules, the old entry is dropped lazily
+        key = email_id << 1 | kind
+        due_epoch = math.ceil(due_epoch) # Never earlier than the stored deadline, fire_deadlines rechecks it against the database
+        with self._cond:
+            if self._due.get(key) == due_epoch:
+                return
+            self._due[key] = due_epoch
+            entry = due_epoch << ID_BITS | key
+            heapq.heappush(self._heap, entry)
+            self._compact()
+            if self._heap[0] == entry:
+                self._cond.notify()
+
+    def reschedule_many(self, kind, deadlines): # [(email_id, due_epoch or None)] under one lock, None unschedules
+        with self._cond:
+            for email_id, due_epoch in deadlines:
+                key = email_id << 1 | kind
+                if due_epoch is None:
+                    self._due.pop(key, None)
+                    continue
+                due_epoch = math.ceil(due_epoch)
+                if self._due.get(key) != due_epoch:
+                    self._due[key] = due_epoch
+                    heapq.heappush(self._heap, due_epoch << ID_BITS | key)
+            self._compact()
+            self._cond.notify()
+
+    def unschedule(self, email_id, kind):
+        with self._cond:
+            return self._due.pop(email_id << 1 | kind, None) is not None
+
+    def _compact(self): # Rebuild once stale entries outnumber live ones
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [due << ID_BITS | key for key, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now=None): # Removes and returns the next live entry that is due, or None
+        now = time.time() if now is None else now
+        with self._cond:
+            return self._pop_due(now)
+
+    def _pop_batch(self, now):
+        batch = []
+        while len(batch) < self.max_batch:
+            item = self._pop_due(now)
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _tick_end(self, due_epoch): # Deadlines are coalesced into tick-aligned batches
+        return math.ceil(due_epoch / self.tick) * self.tick if self.tick else due_epoch
+
+    def _pop_due(self, now):
+        while self._heap:
+            entry = self._heap[0]
+            due_epoch, key = entry >> ID_BITS, entry & ((1 << ID_BITS) - 1)
+            if self._due.get(key) != due_epoch:
+                heapq.heappop(self._heap)
+                continue
+            if due_epoch > now:
+                return None
+            heapq.heappop(self._heap)
+            del self._due[key]
+            return key >> 1, key & 1
+        return None
+
+    def _next_due(self):
+        while self._heap:
+            entry = self._heap[0]
+            due_epoch, key = entry >> ID_BITS, entry & ((1 << ID_BITS) - 1)
+            if self._due.get(key) == due_epoch:
+                return due_epoch
+            heapq.heappop(self._heap)
+        return None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='due-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = []
+                while self._running:
+                    next_due = self._next_due()
+                    now = time.time()
+                    if next_due is not None and self._tick_end(next_due) <= now:
+                        batch = self._pop_batch(now)
+                        break
+                    self._cond.wait(None if next_due is None else self._tick_end(next_due) - now)
+                if not self._running:
+                    return
+            self.fired += len(batch)
+            self.batches += 1
+            try:
+                self._callback(batch)
+            except Exception as e: # The entries are already gone from memory, dropping them would lose the sends
+                print(f"[DUE QUEUE] Error dispatching {len(batch)} deadlines, retrying in {self.retry_delay}s: {e}")
+                self._retry(batch)
+
+    def _retry(self, batch): # Puts a failed batch back, deadlines scheduled again meanwhile keep their newer time
+        due_epoch = math.ceil(time.time() + self.retry_delay)
+        with self._cond:
+            for email_id, kind in batch:
+                key = email_id << 1 | kind
+                if key not in self._due:
+                    self._due[key] = due_epoch
+                    heapq.heappush(self._heap, due_epoch << ID_BITS | key)
+            self.retried += len(batch)
+            self._compact()
+            self._cond.notify()
+
+    def stats(self):
+        return {"scheduled": len(self._due), "heap_entries": len(self._heap), "fired": self.fired, "batches": self.batches, "retried": self.retried}
@@ -0,0 +1,85 @@
+import threading
+
+class HeartbeatBuffer: # Coalesces check-ins per (user_id, code) in memory and flushes them in batches
+    def __init__(self, flush, interval=1.0, max_size=10000):
+        self._flush = flush # Called with {(user_id, code): latest check-in time}
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+        self.recorded = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_errors = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, user_id, code, checked_in_at):
+        key = (user_id, code)
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is None:
+                self._pending[key] = checked_in_at
+            else:
+                self.coalesced += 1
+                if checked_in_at > previous:
+                    self._pending[key] = checked_in_at
+            self.recorded += 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wakeup.set()
+        self.start()
+
+    def flush(self): # Swaps the buffer out so check-ins arriving during the write land in the next batch
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self._flush(pending)
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"[HEARTBEAT] Error flushing {len(pending)} check-ins: {e}")
+            with self._lock: # Put them back unless a newer check-in arrived meanwhile
+                for key, checked_in_at in pending.items():
+                    if self._pending.get(key, checked_in_at) <= checked_in_at:
+                        self._pending[key] = checked_in_at
+            return 0
+        self.flushes += 1
+        self.flushed += len(pending)
+        return len(pending)
+
+    def start(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name='heartbeat-flush', daemon=True)
+                    self._flusher.start()
+
+    def stop(self): # Final flush so a graceful shutdown loses nothing
+        self._stop.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _flush_loop(self): # Every interval, or early once max_size keys are waiting
+        while not self._stop.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors
+        }
@@ -0,0 +1,56 @@
+import re
+from functools import lru_cache
+from dateutil.relativedelta import relativedelta
+
+UNITS = {'y': 'years', 'Y': 'years', 'M': 'months', 'd': 'days', 'D': 'days', 'h': 'hours', 'H': 'hours', 'm': 'minutes'} # M is months, m is minutes
+TOKEN = re.compile(r'(\d+)([yYMdDhHm])')
+CACHE_SIZE = 1024
+
+class Interval: # Immutable parsed interval such as "1y 2M 3d 4h 5m"
+    __slots__ = ('years', 'months', 'days', 'hours', 'minutes')
+
+    def __init__(self, years=0, months=0, days=0, hours=0, minutes=0):
+        object.__setattr__(self, 'years', years)
+        object.__setattr__(self, 'months', months)
+        object.__setattr__(self, 'days', days)
+        object.__setattr__(self, 'hours', hours)
+        object.__setattr__(self, 'minutes', minutes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Interval is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Interval is immutable")
+
+    def _fields(self):
+        return (self.years, self.months, self.days, self.hours, self.minutes)
+
+    def __eq__(self, other):
+        return isinstance(other, Interval) and self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return f"Interval(years={self.years}, months={self.months}, days={self.days}, hours={self.hours}, minutes={self.minutes})"
+
+    def delta(self):
+        return relativedelta(years=self.years, months=self.months, days=self.days, hours=self.hours, minutes=self.minutes)
+
+@lru_cache(maxsize=CACHE_SIZE) # Users reuse a handful of strings such as "7d" and "1M"
+def parse_duration(text): # Validates and parses in one pass, None if invalid. Spaces are ignored and each unit may appear once
+    text = text.replace(" ", "")
+    if not text:
+        return None
+    fields = {}
+    pos = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            return None
+        field = UNITS[match.group(2)]
+        if field in fields:
+            return None
+        fields[field] = int(match.group(1))
+        pos = match.end()
+    return Interval(**fields)
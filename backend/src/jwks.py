@@ -0,0 +1,93 @@
+import json, threading, time
+from urllib.request import urlopen
+from jose import jwk
+
+class JWKSKeyStore: # Process-wide cache of Auth0 signing keys, indexed by kid
+    def __init__(self, url, ttl=3600, miss_cooldown=30, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.miss_cooldown = miss_cooldown
+        self.timeout = timeout
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_fetch = None
+        self._refresher = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get_key(self, kid):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded and self._cooled_down():
+                    self._fetch()
+            self.start()
+        key = self._keys.get(kid)
+        if key is not None:
+            self.hits += 1
+            return key
+        self.misses += 1
+        with self._lock: # Unknown kid, re-fetch unless we just did
+            key = self._keys.get(kid)
+            if key is None and self._cooled_down():
+                self._fetch()
+                key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        with self._lock:
+            return self._fetch()
+
+    def _cooled_down(self):
+        return self._last_fetch is None or time.monotonic() - self._last_fetch >= self.miss_cooldown
+
+    def _fetch(self):
+        self._last_fetch = time.monotonic()
+        try:
+            with urlopen(self.url, timeout=self.timeout) as response:
+                jwks = json.loads(response.read())
+            keys = {}
+            for key in jwks['keys']:
+                if key.get('kty') != 'RSA' or 'kid' not in key:
+                    continue
+                keys[key['kid']] = jwk.construct({
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key.get('use', 'sig'),
+                    'n': key['n'],
+                    'e': key['e']
+                }, algorithm='RS256')
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"[JWKS] Error retrieving JWKS: {e}")
+            return False
+        self._keys = keys
+        self._loaded = True
+        self.refreshes += 1
+        return True
+
+    def start(self):
+        if self._refresher is None and self.ttl:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh_loop, name='jwks-refresh', daemon=True)
+                    self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.ttl):
+            self.refresh()
+
+    def stats(self):
+        return {
+            "keys": len(self._keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
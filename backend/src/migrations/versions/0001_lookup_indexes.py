@@ -0,0 +1,45 @@
+"""Index User.email and the Emails (user_id, code) lookups
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+Databases created with db.create_all() before this revision have no
+indexes. Run "alembic upgrade head" on them. The app refuses to start on a
+database that is not at head, except an empty one, which check_schema()
+creates from the models and stamps.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Concurrent first logins could create duplicate users. Keep the oldest row per email.
+    op.execute(
+        'UPDATE emails SET user_id = (SELECT MIN(keep.id) FROM "user" dup JOIN "user" keep ON keep.email = dup.email WHERE dup.id = emails.user_id) '
+        'WHERE user_id IN (SELECT dup.id FROM "user" dup WHERE dup.id > (SELECT MIN(keep.id) FROM "user" keep WHERE keep.email = dup.email))'
+    )
+    op.execute('DELETE FROM "user" WHERE id > (SELECT MIN(keep.id) FROM "user" keep WHERE keep.email = "user".email)')
+    # Orphaned rows would violate the new foreign key
+    op.execute('UPDATE emails SET user_id = NULL WHERE user_id NOT IN (SELECT id FROM "user")')
+
+    op.create_index('ix_user_email', 'user', ['email'], unique=True)
+    op.create_index('ix_emails_user_id_code', 'emails', ['user_id', 'code'])
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.create_foreign_key('fk_emails_user_id_user', 'user', ['user_id'], ['id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.drop_constraint('fk_emails_user_id_user', type_='foreignkey')
+    op.drop_index('ix_emails_user_id_code', table_name='emails')
+    op.drop_index('ix_user_email', table_name='user')
@@ -0,0 +1,107 @@
+"""Store the interval deadline in an indexed next_due_at column
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 13:00:00
+
+last_checkin used to be written as an aware datetime in the email's timezone
+into a timestamp without time zone column. What got stored depends on the driver:
+SQLite (and MySQL) drop the offset and keep the wall-clock time in the email's
+timezone, PostgreSQL converts it to the session TimeZone (usually UTC) first.
+It is converted to UTC here, and next_due_at is backfilled from it.
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pytz
+from dateutil.relativedelta import relativedelta
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+emails = sa.table(
+    'emails',
+    sa.column('id', sa.Integer),
+    sa.column('interval', sa.String),
+    sa.column('last_checkin', sa.DateTime),
+    sa.column('timezone', sa.String),
+    sa.column('next_due_at', sa.DateTime),
+)
+
+UNITS = {'y': 'years', 'Y': 'years', 'M': 'months', 'd': 'days', 'D': 'days', 'h': 'hours', 'H': 'hours', 'm': 'minutes'}
+
+
+def stored_timezone(connection): # None means last_checkin holds wall-clock time in each email's own timezone
+    if connection.dialect.name != 'postgresql':
+        return None
+    session_timezone = connection.exec_driver_sql('SHOW TIME ZONE').scalar()
+    if session_timezone not in pytz.all_timezones_set:
+        raise RuntimeError(f"PostgreSQL TimeZone {session_timezone!r} is not a named timezone, set it to the zone last_checkin was written in and rerun")
+    return session_timezone
+
+
+def to_utc(wall_time, timezone):
+    if wall_time is None or timezone not in pytz.all_timezones_set:
+        return wall_time
+    return pytz.timezone(timezone).localize(wall_time).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def next_due_at(interval, last_checkin, timezone):
+    if last_checkin is None or not interval or timezone not in pytz.all_timezones_set:
+        return None
+    cleaned = interval.replace(' ', '')
+    parts = re.findall(r'(\d+)([YyMDdHhm])', cleaned)
+    if not parts or ''.join(num + unit for num, unit in parts) != cleaned:
+        return None
+    kwargs = {UNITS[unit]: int(num) for num, unit in parts}
+    pytztimezone = pytz.timezone(timezone)
+    local_checkin = pytz.utc.localize(last_checkin).astimezone(pytztimezone).replace(tzinfo=None)
+    due = pytztimezone.localize(local_checkin + relativedelta(**kwargs))
+    return due.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.add_column(sa.Column('next_due_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_emails_next_due_at', ['next_due_at'])
+
+    connection = op.get_bind()
+    source_timezone = stored_timezone(connection)
+    rows = connection.execute(sa.select(emails.c.id, emails.c.interval, emails.c.last_checkin, emails.c.timezone)).all()
+    updates = []
+    for row in rows:
+        last_checkin = to_utc(row.last_checkin, source_timezone or row.timezone)
+        updates.append({'b_id': row.id, 'last_checkin': last_checkin, 'next_due_at': next_due_at(row.interval, last_checkin, row.timezone)})
+    if updates:
+        connection.execute(
+            emails.update().where(emails.c.id == sa.bindparam('b_id')),
+            updates
+        )
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    target_timezone = stored_timezone(connection)
+    rows = connection.execute(sa.select(emails.c.id, emails.c.last_checkin, emails.c.timezone)).all()
+    updates = []
+    for row in rows:
+        wall_time = row.last_checkin
+        timezone = target_timezone or row.timezone
+        if wall_time is not None and timezone in pytz.all_timezones_set:
+            wall_time = pytz.utc.localize(wall_time).astimezone(pytz.timezone(timezone)).replace(tzinfo=None)
+        updates.append({'b_id': row.id, 'last_checkin': wall_time})
+    if updates:
+        connection.execute(
+            emails.update().where(emails.c.id == sa.bindparam('b_id')).values(last_checkin=sa.bindparam('last_checkin')),
+            updates
+        )
+
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.drop_index('ix_emails_next_due_at')
+        batch_op.drop_column('next_due_at')
@@ -0,0 +1,84 @@
+"""Track send_at and dispatch state for the database dispatcher
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:00:00
+
+Deadlines that have already passed are marked as sent. This stops the
+dispatcher from firing old emails the first time it runs.
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import pytz
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+emails = sa.table(
+    'emails',
+    sa.column('id', sa.Integer),
+    sa.column('send_time', sa.String),
+    sa.column('timezone', sa.String),
+    sa.column('next_due_at', sa.DateTime),
+    sa.column('send_at', sa.DateTime),
+    sa.column('interval_sent_at', sa.DateTime),
+    sa.column('send_time_sent_at', sa.DateTime),
+)
+
+
+def send_at(send_time, timezone):
+    if not send_time or timezone not in pytz.all_timezones_set:
+        return None
+    try:
+        local = datetime.fromisoformat(send_time)
+    except ValueError:
+        return None
+    return pytz.timezone(timezone).localize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.add_column(sa.Column('send_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('interval_sent_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('send_time_sent_at', sa.DateTime(), nullable=True))
+        batch_op.drop_index('ix_emails_next_due_at')
+
+    connection = op.get_bind()
+    now = datetime.now(pytz.utc).replace(tzinfo=None)
+    rows = connection.execute(sa.select(emails.c.id, emails.c.send_time, emails.c.timezone, emails.c.next_due_at)).all()
+    updates = []
+    for row in rows:
+        row_send_at = send_at(row.send_time, row.timezone)
+        updates.append({
+            'b_id': row.id,
+            'send_at': row_send_at,
+            'send_time_sent_at': now if row_send_at and row_send_at <= now else None,
+            'interval_sent_at': now if row.next_due_at and row.next_due_at <= now else None
+        })
+    if updates:
+        connection.execute(
+            emails.update().where(emails.c.id == sa.bindparam('b_id')),
+            updates
+        )
+
+    op.create_index('ix_emails_interval_pending', 'emails', ['next_due_at'],
+                    postgresql_where=sa.text('interval_sent_at IS NULL'), sqlite_where=sa.text('interval_sent_at IS NULL'))
+    op.create_index('ix_emails_send_time_pending', 'emails', ['send_at'],
+                    postgresql_where=sa.text('send_time_sent_at IS NULL'), sqlite_where=sa.text('send_time_sent_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_emails_send_time_pending', table_name='emails')
+    op.drop_index('ix_emails_interval_pending', table_name='emails')
+    with op.batch_alter_table('emails') as batch_op:
+        batch_op.create_index('ix_emails_next_due_at', ['next_due_at'])
+        batch_op.drop_column('send_time_sent_at')
+        batch_op.drop_column('interval_sent_at')
+        batch_op.drop_column('send_at')
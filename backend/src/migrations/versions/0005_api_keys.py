@@ -0,0 +1,41 @@
+"""Add per-user API keys for the heartbeat endpoint
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 18:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'api_key',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('prefix', sa.String(length=12), nullable=True),
+        sa.Column('key_hash', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='fk_api_key_user_id_user'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_api_key_user_id', 'api_key', ['user_id'])
+    op.create_index('ix_api_key_prefix', 'api_key', ['prefix'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_api_key_prefix', table_name='api_key')
+    op.drop_index('ix_api_key_user_id', table_name='api_key')
+    op.drop_table('api_key')
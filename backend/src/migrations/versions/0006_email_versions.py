@@ -0,0 +1,33 @@
+"""Add per-user-per-code listing versions for request_emails ETags
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 20:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'email_version',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('code', sa.String(length=100), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='fk_email_version_user_id_user'),
+        sa.PrimaryKeyConstraint('user_id', 'code')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('email_version')
@@ -0,0 +1,37 @@
+import os
+from datetime import timezone
+
+TIMEZONE_BACKEND = os.getenv('TIMEZONE_BACKEND', 'pytz') # 'pytz' or 'zoneinfo'
+
+if TIMEZONE_BACKEND == 'zoneinfo':
+    from zoneinfo import ZoneInfo, available_timezones
+    UTC = timezone.utc
+    TIMEZONE_NAMES = frozenset(available_timezones())
+
+    def localize(tz, local): # Ambiguous and missing wall-clock times resolve with fold=0
+        return local.replace(tzinfo=tz)
+
+    load_timezone = ZoneInfo
+else:
+    import pytz
+    UTC = pytz.utc
+    TIMEZONE_NAMES = frozenset(pytz.all_timezones)
+
+    def localize(tz, local):
+        return tz.localize(local)
+
+    load_timezone = pytz.timezone
+
+TIMEZONES = {name: load_timezone(name) for name in TIMEZONE_NAMES} # Preloaded so request paths never touch the tz database
+
+def is_valid_timezone(name):
+    return name in TIMEZONE_NAMES
+
+def to_utc(local, name): # Naive wall-clock time in the named zone -> naive UTC
+    return localize(TIMEZONES[name], local).astimezone(UTC).replace(tzinfo=None)
+
+def from_utc(utc, name): # Naive UTC -> aware time in the named zone
+    return utc.replace(tzinfo=UTC).astimezone(TIMEZONES[name])
+
+def utc_timestamp(utc): # Naive UTC -> epoch seconds
+    return utc.replace(tzinfo=UTC).timestamp()
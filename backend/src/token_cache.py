@@ -0,0 +1,73 @@
+import hashlib, threading, time
+from collections import OrderedDict
+
+class VerifiedTokenCache: # Bounded LRU of verified token claims, keyed by SHA-256 of the token
+    def __init__(self, max_size=10000, max_ttl=3600, enabled=True):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.enabled = enabled and max_size > 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        if not self.enabled:
+            return None
+        key = self.digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        if not self.enabled:
+            return
+        exp = payload.get('exp')
+        now = time.time()
+        expires_at = now + self.max_ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp)) # Never outlive the token itself
+        if expires_at <= now:
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(self.digest(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
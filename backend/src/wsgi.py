@@ -0,0 +1,115 @@
+from gevent import monkey
+monkey.patch_all()
+
+import os, signal, socket, sys
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer, WSGIHandler
+from gevent.socket import wait_read, wait_write
+import psycopg2
+from psycopg2 import extensions
+from app import app, db, check_schema, init_scheduler, scheduler, due_queue, mailer, heartbeat_buffer, SCHEDULER_MODE
+
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', 5000))
+WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+BACKLOG = int(os.getenv('BACKLOG', 1024))
+WORKER_CONNECTIONS = int(os.getenv('WORKER_CONNECTIONS', 1000)) # Concurrent requests per worker, the pool lets shutdown wait for them
+KEEPALIVE_TIMEOUT = float(os.getenv('KEEPALIVE_TIMEOUT', 5))
+GRACEFUL_TIMEOUT = float(os.getenv('GRACEFUL_TIMEOUT', 30))
+SCHEDULER_WORKER = 0 # Only this worker runs the scheduler so periodic jobs fire once
+
+def gevent_wait_callback(conn, timeout=None): # Lets psycopg2 yield to other greenlets while waiting on the socket
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+extensions.set_wait_callback(gevent_wait_callback)
+
+class KeepAliveHandler(WSGIHandler): # Drop idle keep-alive connections instead of holding a greenlet forever
+    def handle(self):
+        if KEEPALIVE_TIMEOUT > 0:
+            self.socket.settimeout(KEEPALIVE_TIMEOUT)
+        return super().handle()
+
+def run_worker(listener, index):
+    server = WSGIServer(listener, app, spawn=Pool(WORKER_CONNECTIONS), handler_class=KeepAliveHandler, log=None)
+
+    def shutdown(): # Only stops accepting, serve_forever then waits for in-flight requests
+        print(f"[WSGI] Worker {index} ({os.getpid()}) shutting down")
+        server.close()
+
+    gevent.signal_handler(signal.SIGTERM, shutdown)
+    gevent.signal_handler(signal.SIGINT, shutdown)
+    if index == SCHEDULER_WORKER:
+        with app.app_context():
+            init_scheduler()
+    print(f"[WSGI] Worker {index} ({os.getpid()}) serving on {HOST}:{PORT}")
+    server.serve_forever(stop_timeout=GRACEFUL_TIMEOUT)
+    # Requests have drained, flush what they left behind before the process exits
+    heartbeat_buffer.stop()
+    due_queue.stop()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    mailer.shutdown()
+    print(f"[WSGI] Worker {index} ({os.getpid()}) stopped")
+
+def spawn_worker(listener, index):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(listener, index)
+        finally:
+            os._exit(0)
+    return pid
+
+def main():
+    if WORKERS > 1 and SCHEDULER_MODE != 'database':
+        # The in-memory due queue lives in worker 0 only, check-ins served by other workers would never reach it
+        print("[WSGI] WEB_CONCURRENCY above 1 requires SCHEDULER_MODE=database")
+        return 1
+    with app.app_context():
+        if not check_schema():
+            return 1
+        db.engine.dispose() # Workers must not share the master's connections
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, PORT))
+    listener.listen(BACKLOG)
+    if WORKERS <= 1:
+        run_worker(listener, SCHEDULER_WORKER)
+        return
+
+    workers = {spawn_worker(listener, index): index for index in range(WORKERS)}
+    stopping = False
+
+    def stop():
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    gevent.signal_handler(signal.SIGTERM, stop)
+    gevent.signal_handler(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is not None and not stopping: # Respawn crashed workers under the same index
+            print(f"[WSGI] Worker {index} ({pid}) exited with status {status}, restarting")
+            workers[spawn_worker(listener, index)] = index
+
+if __name__ == '__main__':
+    sys.exit(main())
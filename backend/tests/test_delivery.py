@@ -0,0 +1,139 @@
+import socket, threading
+from email.mime.text import MIMEText
+import pytest
+from delivery import Mailer, SMTPTransport, is_temporary
+
+Controller = pytest.importorskip('aiosmtpd.controller').Controller
+
+class SMTPServer: # Local aiosmtpd stand-in that records every transaction, refuses recipients starting with "refused" and greylists "grey"
+    def __init__(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.transactions = []
+        self.sessions = set()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._controller = None
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        session.host_name = hostname
+        return responses
+
+    async def handle_QUIT(self, server, session, envelope):
+        with self._lock:
+            self.active -= 1
+        return '221 Bye'
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('refused'):
+            return '550 5.1.1 No such user'
+        if address.startswith('grey'):
+            return '451 4.7.1 Greylisted, try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.transactions.append((envelope.mail_from, list(envelope.rcpt_tos), envelope.content))
+            self.sessions.add(id(session))
+        return '250 Message accepted for delivery'
+
+    def recipients(self):
+        return [rcpt_tos for mail_from, rcpt_tos, content in self.transactions]
+
+    def start(self):
+        self._controller = Controller(self, hostname='127.0.0.1', port=self.port)
+        self._controller.start()
+
+    def stop(self):
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
+
+    def restart(self): # Drops every open connection, pooled clients only notice on their next command
+        self.stop()
+        self.active = 0
+        self.start()
+
+def message(subject='Subject'):
+    message = MIMEText('Body', 'plain', 'utf-8')
+    message['Subject'] = subject
+    return message
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def transport(smtp_server):
+    transport = SMTPTransport('127.0.0.1', smtp_server.port, timeout=5)
+    yield transport
+    transport.close()
+
+def test_sends_one_transaction_for_all_recipients(smtp_server, transport):
+    assert transport.send('from@example.com', ['a@example.com', 'b@example.com'], message()) == {'a@example.com': 'sent', 'b@example.com': 'sent'}
+    mail_from, rcpt_tos, content = smtp_server.transactions[0]
+    assert mail_from == 'from@example.com'
+    assert rcpt_tos == ['a@example.com', 'b@example.com']
+    assert b'Subject: Subject' in content
+
+def test_reuses_pooled_connection(smtp_server, transport):
+    for i in range(5):
+        transport.send('from@example.com', ['a@example.com'], message(f'Subject {i}'))
+    assert len(smtp_server.transactions) == 5
+    assert len(smtp_server.sessions) == 1
+    assert transport.connections_opened == 1
+
+def test_reports_refused_recipients(smtp_server, transport):
+    statuses = transport.send('from@example.com', ['a@example.com', 'refused@example.com'], message())
+    assert statuses['a@example.com'] == 'sent'
+    assert statuses['refused@example.com'] == '550 5.1.1 No such user'
+    assert not is_temporary(statuses['refused@example.com'])
+    statuses = transport.send('from@example.com', ['refused@example.com'], message()) # Every recipient refused
+    assert statuses['refused@example.com'] == '550 5.1.1 No such user'
+    transport.send('from@example.com', ['b@example.com'], message()) # The connection stays usable
+    assert smtp_server.recipients() == [['a@example.com'], ['b@example.com']]
+    assert transport.connections_opened == 1
+
+def test_marks_greylisted_recipients_temporary(smtp_server, transport):
+    statuses = transport.send('from@example.com', ['a@example.com', 'grey@example.com'], message())
+    assert statuses['a@example.com'] == 'sent'
+    assert statuses['grey@example.com'].startswith('451 ')
+    assert is_temporary(statuses['grey@example.com'])
+    assert not is_temporary(statuses['a@example.com'])
+    statuses = transport.send('from@example.com', ['grey@example.com'], message()) # Every recipient greylisted
+    assert is_temporary(statuses['grey@example.com'])
+
+def test_reconnects_after_server_restart(smtp_server, transport):
+    transport.send('from@example.com', ['a@example.com'], message())
+    smtp_server.restart()
+    assert transport.send('from@example.com', ['b@example.com'], message()) == {'b@example.com': 'sent'}
+    assert transport.connections_opened == 2
+    assert smtp_server.recipients() == [['a@example.com'], ['b@example.com']]
+
+def test_fails_when_server_is_down(smtp_server, transport):
+    smtp_server.stop()
+    with pytest.raises(OSError):
+        transport.send('from@example.com', ['a@example.com'], message())
+
+def test_mailer_bounds_connections_and_groups_by_domain(smtp_server):
+    transport = SMTPTransport('127.0.0.1', smtp_server.port, timeout=5, pool_size=2)
+    mailer = Mailer(transport, concurrency=8)
+    futures = []
+    for i in range(20):
+        futures += mailer.submit_by_domain('from@example.com', [f'a{i}@one.example', f'b{i}@two.example', f'c{i}@ONE.example'], message(f'Subject {i}'))
+    results = [future.result() for future in futures]
+    mailer.shutdown()
+    assert len(results) == 40 # One transaction per domain per message
+    assert all(status == 'sent' for result in results for status in result.values())
+    assert sorted(len(rcpt_tos) for rcpt_tos in smtp_server.recipients()) == [1] * 20 + [2] * 20
+    assert transport.connections_opened <= 2
+    assert smtp_server.max_active <= 2
@@ -0,0 +1,101 @@
+import threading, time
+from duequeue import DueQueue, SEND_TIME, INTERVAL
+
+def noop(batch):
+    pass
+
+def test_rounds_deadlines_up_to_whole_seconds():
+    queue = DueQueue(noop)
+    queue.schedule(1, SEND_TIME, 100.2)
+    assert queue.get(1, SEND_TIME) == 101
+    assert queue.pop_due(100.9) is None # Never fires before the stored deadline
+    assert queue.pop_due(101) == (1, SEND_TIME)
+
+def test_reschedule_leaves_stale_entry_behind():
+    queue = DueQueue(noop)
+    queue.schedule(1, SEND_TIME, 100)
+    queue.schedule(1, SEND_TIME, 200)
+    assert len(queue) == 1
+    assert queue.stats()["heap_entries"] == 2
+    assert queue.pop_due(150) is None # The stale entry at 100 is skipped and dropped
+    assert queue.stats()["heap_entries"] == 1
+    assert queue.pop_due(200) == (1, SEND_TIME)
+
+def test_unschedule_is_lazy():
+    queue = DueQueue(noop)
+    queue.schedule(1, SEND_TIME, 100)
+    queue.schedule(1, INTERVAL, 100)
+    assert queue.unschedule(1, SEND_TIME)
+    assert not queue.unschedule(1, SEND_TIME)
+    assert (1, SEND_TIME) not in queue and (1, INTERVAL) in queue
+    assert queue.stats()["heap_entries"] == 2
+    assert queue.pop_due(100) == (1, INTERVAL)
+    assert queue.pop_due(100) is None
+
+def test_reschedule_many_unschedules_on_none():
+    queue = DueQueue(noop)
+    queue.reschedule_many(INTERVAL, [(1, 100), (2, 100.5), (3, 300)])
+    queue.reschedule_many(INTERVAL, [(1, None), (3, 99)])
+    assert sorted(queue.pop_due(101) for _ in range(2)) == [(2, INTERVAL), (3, INTERVAL)]
+    assert queue.pop_due(1000) is None
+
+def test_compacts_stale_entries():
+    queue = DueQueue(noop)
+    for email_id in range(10):
+        queue.schedule(email_id, SEND_TIME, 100)
+    for due_epoch in range(101, 5101):
+        queue.schedule(0, SEND_TIME, due_epoch)
+    assert len(queue) == 10
+    assert queue.stats()["heap_entries"] <= 2 * 10 + 1024 + 1
+    assert sorted(queue.pop_due(100) for _ in range(9)) == [(email_id, SEND_TIME) for email_id in range(1, 10)]
+    assert queue.pop_due(5099) is None
+    assert queue.pop_due(5100) == (0, SEND_TIME)
+
+def test_coalesces_deadlines_into_tick_aligned_batches():
+    queue = DueQueue(noop, tick=5, max_batch=3)
+    assert [queue._tick_end(due_epoch) for due_epoch in (101, 104, 105, 106)] == [105, 105, 105, 110]
+    assert DueQueue(noop, tick=0)._tick_end(101) == 101
+    for email_id, due_epoch in enumerate((101, 102, 103, 104, 106)):
+        queue.schedule(email_id, SEND_TIME, due_epoch)
+    assert queue._pop_batch(105) == [(0, SEND_TIME), (1, SEND_TIME), (2, SEND_TIME)] # Capped at max_batch
+    assert queue._pop_batch(105) == [(3, SEND_TIME)] # 106 belongs to the next tick
+    assert queue._pop_batch(110) == [(4, SEND_TIME)]
+
+def test_dispatcher_splits_due_deadlines_by_max_batch():
+    batches = []
+    done = threading.Event()
+    def callback(batch):
+        batches.append(batch)
+        if sum(len(batch) for batch in batches) == 5:
+            done.set()
+    queue = DueQueue(callback, tick=5, max_batch=2)
+    for email_id in range(5):
+        queue.schedule(email_id, INTERVAL, time.time() - 60)
+    queue.start()
+    assert done.wait(5)
+    queue.stop()
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert queue.stats()["fired"] == 5 and queue.stats()["batches"] == 3
+
+def test_retries_a_batch_whose_callback_raised():
+    calls = []
+    done = threading.Event()
+    def callback(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+        done.set()
+    queue = DueQueue(callback, tick=1, retry_delay=0)
+    queue.schedule(1, SEND_TIME, time.time() - 60)
+    queue.start()
+    assert done.wait(5)
+    queue.stop()
+    assert calls == [[(1, SEND_TIME)], [(1, SEND_TIME)]]
+    assert queue.stats()["retried"] == 1
+
+def test_retry_keeps_newer_schedule():
+    queue = DueQueue(noop, retry_delay=5)
+    queue.schedule(2, SEND_TIME, 10 ** 10)
+    queue._retry([(1, SEND_TIME), (2, SEND_TIME)])
+    assert queue.get(1, SEND_TIME) <= time.time() + 6
+    assert queue.get(2, SEND_TIME) == 10 ** 10
@@ -0,0 +1,36 @@
+import pytest
+from heartbeat import HeartbeatBuffer
+
+@pytest.fixture
+def flushed():
+    return []
+
+@pytest.fixture
+def buffer(flushed):
+    buffer = HeartbeatBuffer(flushed.append, interval=3600) # Flushed by hand, the background flusher never fires
+    yield buffer
+    buffer.stop()
+
+def test_coalesces_to_latest_check_in(buffer, flushed):
+    buffer.record(1, 'a', 10)
+    buffer.record(1, 'a', 30)
+    buffer.record(1, 'a', 20) # Out of order, the latest time is kept
+    buffer.record(2, 'a', 5)
+    assert buffer.flush() == 2
+    assert flushed == [{(1, 'a'): 30, (2, 'a'): 5}]
+    assert buffer.stats()["coalesced"] == 2
+    assert buffer.flush() == 0
+
+def test_puts_entries_back_when_flush_fails(buffer, flushed):
+    def failing_flush(pending):
+        buffer.record(1, 'a', 50) # Arrives while the failed write is in flight
+        raise RuntimeError("database unavailable")
+    buffer._flush = failing_flush
+    buffer.record(1, 'a', 40)
+    buffer.record(2, 'a', 40)
+    assert buffer.flush() == 0
+    assert len(buffer) == 2
+    assert buffer.stats()["flush_errors"] == 1
+    buffer._flush = flushed.append
+    assert buffer.flush() == 2
+    assert flushed == [{(1, 'a'): 50, (2, 'a'): 40}] # The newer check-in was not overwritten
@@ -0,0 +1,87 @@
+import json, time
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jwks import JWKSKeyStore
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    public_jwk = jwk.construct(public_pem, algorithm='RS256').to_dict()
+    return private_pem, {"kty": "RSA", "kid": kid, "use": "sig", "n": public_jwk['n'], "e": public_jwk['e']}
+
+@pytest.fixture(scope='module')
+def keys():
+    return {kid: make_key(kid) for kid in ('k1', 'k2')}
+
+@pytest.fixture
+def jwks_file(tmp_path):
+    path = tmp_path / 'jwks.json'
+    def write(*entries):
+        path.write_text(json.dumps({"keys": list(entries)}))
+    return path, write
+
+def test_loads_once_and_serves_hits(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1], {"kty": "EC", "kid": "ec"})
+    store = JWKSKeyStore(path.as_uri(), ttl=0)
+    assert store.get_key('k1') is not None
+    assert store.get_key('k1') is not None
+    assert store.stats() == {"keys": 1, "hits": 2, "misses": 0, "refreshes": 1, "refresh_errors": 0}
+
+def test_key_verifies_tokens(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1])
+    store = JWKSKeyStore(path.as_uri(), ttl=0)
+    token = jwt.encode({"sub": "user", "aud": "aud"}, keys['k1'][0], algorithm='RS256', headers={"kid": "k1"})
+    assert jwt.decode(token, store.get_key('k1'), algorithms=['RS256'], audience='aud')['sub'] == 'user'
+    other = jwt.encode({"sub": "user", "aud": "aud"}, keys['k2'][0], algorithm='RS256', headers={"kid": "k1"})
+    with pytest.raises(jwt.JWTError):
+        jwt.decode(other, store.get_key('k1'), algorithms=['RS256'], audience='aud')
+
+def test_unknown_kid_refetches(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1])
+    store = JWKSKeyStore(path.as_uri(), ttl=0, miss_cooldown=0)
+    assert store.get_key('k1') is not None
+    write(keys['k1'][1], keys['k2'][1]) # Rotated in
+    assert store.get_key('k2') is not None
+    assert store.stats()['refreshes'] == 2
+    assert store.stats()['misses'] == 1
+
+def test_unknown_kid_respects_cooldown(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1])
+    store = JWKSKeyStore(path.as_uri(), ttl=0, miss_cooldown=3600)
+    assert store.get_key('k1') is not None
+    write(keys['k1'][1], keys['k2'][1])
+    assert store.get_key('k2') is None
+    assert store.get_key('unknown') is None
+    assert store.stats()['refreshes'] == 1
+
+def test_failed_refresh_keeps_keys(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1])
+    store = JWKSKeyStore(path.as_uri(), ttl=0)
+    assert store.get_key('k1') is not None
+    path.unlink()
+    assert store.refresh() is False
+    assert store.get_key('k1') is not None
+    assert store.stats()['refresh_errors'] == 1
+
+def test_background_refresh(keys, jwks_file):
+    path, write = jwks_file
+    write(keys['k1'][1])
+    store = JWKSKeyStore(path.as_uri(), ttl=0.05, miss_cooldown=3600)
+    try:
+        assert store.get_key('k1') is not None
+        write(keys['k2'][1]) # k1 retired, k2 published
+        deadline = time.monotonic() + 5
+        while store.stats()['refreshes'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.get_key('k2') is not None
+        assert store.get_key('k1') is None
+    finally:
+        store.stop()
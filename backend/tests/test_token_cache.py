@@ -0,0 +1,55 @@
+import types
+import pytest
+import token_cache
+from token_cache import VerifiedTokenCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(token_cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def test_evicts_least_recently_used(clock):
+    cache = VerifiedTokenCache(max_size=2)
+    cache.put('a', {"sub": "a"})
+    cache.put('b', {"sub": "b"})
+    assert cache.get('a') == {"sub": "a"} # a is now the most recently used
+    cache.put('c', {"sub": "c"})
+    assert cache.get('b') is None
+    assert cache.get('a') == {"sub": "a"} and cache.get('c') == {"sub": "c"}
+    assert cache.stats()["evictions"] == 1
+
+def test_expires_at_token_exp(clock):
+    cache = VerifiedTokenCache(max_ttl=3600)
+    cache.put('token', {"exp": 1010})
+    clock[0] = 1009.9
+    assert cache.get('token') == {"exp": 1010}
+    clock[0] = 1010
+    assert cache.get('token') is None
+    assert cache.stats()["size"] == 0
+
+def test_max_ttl_caps_long_lived_tokens(clock):
+    cache = VerifiedTokenCache(max_ttl=60)
+    cache.put('token', {"exp": 10 ** 10})
+    clock[0] = 1059
+    assert cache.get('token') is not None
+    clock[0] = 1060
+    assert cache.get('token') is None
+
+def test_skips_expired_tokens_and_disabled_cache(clock):
+    cache = VerifiedTokenCache()
+    cache.put('token', {"exp": 1000})
+    assert cache.stats()["size"] == 0
+    disabled = VerifiedTokenCache(max_size=0)
+    disabled.put('token', {"exp": 2000})
+    assert disabled.get('token') is None
+    assert not disabled.stats()["enabled"]
+
+def test_discard_and_hit_rate(clock):
+    cache = VerifiedTokenCache()
+    cache.put('token', {"exp": 2000})
+    assert cache.get('token') is not None
+    cache.discard('token')
+    assert cache.get('token') is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
@@ -56,14 +56,39 @@ export function FetchToken({ children }: { children: React.ReactNode }) {
   const [userInfo, setUserInfo] = useState<any>(null);
 
   useEffect(() => {
+    let refreshTimer: ReturnType<typeof setTimeout> | undefined;
+
     const checkAuthentication = async () => {
       if (isAuthenticated) {
         const accessToken = await getAccessTokenSilently();
+        try {
+          const response = await fetch(backendUrl + "/session", {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json",
+              Authorization: `Bearer ${accessToken}`,
+            },
+          });
+          if (response.ok) {
+            const data = await response.json();
+            if (data.session_token) {
+              setToken(data.session_token);
+              refreshTimer = setTimeout(
+                checkAuthentication,
+                data.expires_in * 900
+              );
+              return;
+            }
+          }
+        } catch (error) {
+          console.error(error);
+        }
         setToken(accessToken);
       }
     };
 
     checkAuthentication();
+    return () => clearTimeout(refreshTimer);
   }, [isAuthenticated, getAccessTokenSilently]);
 
   useEffect(() => {
@@ -1,6 +1,7 @@
 import { Auth0Context } from "@auth0/auth0-react";
 import { useContext, useEffect, useState } from "react";
 import "../index.css";
+import { clearEmailsCache } from "../emailsCache";
 
 const backendUrl = import.meta.env.VITE_REACT_APP_BACKEND_URL;
 
@@ -89,7 +90,13 @@ function Navbar() {
               >
                 Profile
               </button>
-              <button className="m-2" onClick={() => logout()}>
+              <button
+                className="m-2"
+                onClick={() => {
+                  clearEmailsCache();
+                  logout();
+                }}
+              >
                 Log out
               </button>
             </>
@@ -0,0 +1,36 @@
+// Unlocked email pages, kept in memory only so nothing readable outlives the page or the login
+const emailsCacheMaxPages = 20;
+
+interface CachedEmailsPage {
+  etag: string;
+  data: any;
+}
+
+const pages = new Map<string, CachedEmailsPage>();
+
+// Earlier versions kept the pages in sessionStorage, remove what they left behind
+try {
+  for (const key of Object.keys(sessionStorage)) {
+    if (key.startsWith("emails:")) {
+      sessionStorage.removeItem(key);
+    }
+  }
+} catch (error) {
+  console.error(error);
+}
+
+export function getCachedEmailsPage(key: string) {
+  return pages.get(key) ?? null;
+}
+
+export function cacheEmailsPage(key: string, etag: string, data: any) {
+  pages.delete(key); // Re-inserted as the newest entry, the Map keeps insertion order
+  pages.set(key, { etag, data });
+  while (pages.size > emailsCacheMaxPages) {
+    pages.delete(pages.keys().next().value as string);
+  }
+}
+
+export function clearEmailsCache() {
+  pages.clear();
+}
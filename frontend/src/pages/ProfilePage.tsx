@@ -2,12 +2,14 @@ import { Auth0Context } from "@auth0/auth0-react";
 import { useContext } from "react";
 import { useEffect, useState } from "react";
 import { useAuthToken } from "../Auth0Provider";
+import { cacheEmailsPage, getCachedEmailsPage } from "../emailsCache";
 import "../index.css";
 import moment from "moment-timezone";
 import { parse } from "date-fns";
 import { format, toZonedTime } from "date-fns-tz";
 
 const backendUrl = import.meta.env.VITE_REACT_APP_BACKEND_URL;
+const emailsPageSize = 50;
 
 export default function ProfilePage() {
   interface Email {
@@ -38,6 +40,8 @@ export default function ProfilePage() {
   const [emails, setEmails] = useState<Email[]>([]);
   const [emailsCopy, setEmailsCopy] = useState<Email[]>([]);
   const [unlocked, setUnlocked] = useState<boolean>(false);
+  const [nextCursor, setNextCursor] = useState<number | null>(null);
+  const [loadingMore, setLoadingMore] = useState<boolean>(false);
   const [code, setCode] = useState<string>("");
   // const [userInfo, setUserInfo] = useState<any>(null);
   const [savingText, setSavingText] = useState<string>("Save changes");
@@ -240,25 +244,66 @@ export default function ProfilePage() {
     }
   }
 
-  async function submitCode() {
+  // Pages are cached in memory under a hash of the code, so unlocking again only costs a 304
+  async function emailsCacheKey(after: number | null) {
+    const digest = await crypto.subtle.digest(
+      "SHA-256",
+      new TextEncoder().encode(`${user?.email}:${code}:${after}`)
+    );
+    return (
+      "emails:" +
+      Array.from(new Uint8Array(digest))
+        .map((byte) => byte.toString(16).padStart(2, "0"))
+        .join("")
+    );
+  }
+
+  async function submitCode(after: number | null = null) {
     try {
       if (token && user && code) {
+        setLoadingMore(after !== null);
+        const cacheKey = await emailsCacheKey(after);
+        const cachedPage = getCachedEmailsPage(cacheKey);
         const response = await fetch(backendUrl + "/request_emails", {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
             Authorization: `Bearer ${token}`,
+            ...(cachedPage && { "If-None-Match": cachedPage.etag }),
           },
-          body: JSON.stringify({ code: code }),
+          body: JSON.stringify({
+            code: code,
+            limit: emailsPageSize,
+            ...(after !== null && { after: after }),
+          }),
         });
 
-        if (response.ok) {
-          var data = await response.json();
+        var data = null;
+        if (response.status === 304 && cachedPage) {
+          data = cachedPage.data;
+        } else if (response.ok) {
+          data = await response.json();
+          const etag = response.headers.get("ETag");
+          if (etag && !data.error) {
+            cacheEmailsPage(cacheKey, etag, data);
+          }
+        }
+
+        if (data) {
           if (data.error) {
             alert(data.error);
           } else {
-            setEmails(data.emails);
-            setEmailsCopy(data.emails);
+            if (after === null) {
+              setEmails(data.emails);
+              setEmailsCopy(data.emails);
+            } else {
+              setEmails((currentEmails) => [...currentEmails, ...data.emails]);
+              setEmailsCopy((currentEmails) => [
+                ...currentEmails,
+                ...data.emails,
+              ]);
+            }
+            setNextCursor(data.next_cursor);
             setUnlocked(true);
             for (let i = 0; i < data.emails.length; i++) {
               setCheckboxes((prevCheckboxes) => ({
@@ -271,6 +316,8 @@ export default function ProfilePage() {
       }
     } catch (error) {
       console.error(error);
+    } finally {
+      setLoadingMore(false);
     }
   }
 
@@ -831,6 +878,19 @@ export default function ProfilePage() {
                   </button>
                 </>
               )}
+              {nextCursor !== null && (
+                <>
+                  <button
+                    type="button"
+                    className="mt-1"
+                    disabled={loadingMore}
+                    onClick={() => submitCode(nextCursor)}
+                  >
+                    {loadingMore ? "Loading..." : "Load more emails"}
+                  </button>
+                  <br />
+                </>
+              )}
               {emailsCopy && emailsCopy.length > 0 && (
                 <>
                   <button type="submit" className="mt-2 mr-2">